@@ -0,0 +1,187 @@
+'''
+record and replay of CCM, lscm and REST interactions
+
+A Recorder captures every call to the methods listed in hooks (arguments,
+result or exception, start time and duration) in a gzip-compressed trace
+file. A Player later answers the same calls from the trace, without
+running ccm or lscm or contacting the Jazz server, either as fast as
+possible or at recorded speed.
+
+Calls are matched by kind and key (e.g. the ccm command line), in the
+order they were recorded for that key. Only the outermost hooked call is
+recorded, e.g. the lscm commands inside a CLI.execute are not.
+'''
+import cPickle, gzip, threading, time
+import logging
+
+log = logging.getLogger('calltrace')
+
+class TraceError(Exception):
+	pass
+
+def _ccm_key(self, cmd, ccm_opts='', *args, **kwargs):
+	return '%s %s' % (ccm_opts, cmd)
+
+def _ccm_stream_key(self, cmd, ccm_opts=''):
+	return '%s %s' % (ccm_opts, cmd)
+
+def _cli_key(self, cmd, scm_opts='', json_out=False, cwd=None):
+	# cwd tells apart the same command run in different sandboxes
+	return '%s %s%s%s' % (scm_opts, cmd, ' --json' if json_out else '', ' [%s]' % cwd if cwd else '')
+
+def _cli_run_key(self, cmd, scm_opts='', display=None, cwd=None):
+	# display hides credentials, which must not end up in the trace
+	return '%s %s%s' % (scm_opts, display or cmd, ' [%s]' % cwd if cwd else '')
+
+def _curl_key(self, options, url, max_body=None, data=None, idempotent=True):
+	return str(url)
+
+# (module, class, method, kind, key function)
+hooks = [('ccm', 'CCM', 'execute',        'ccm',        _ccm_key),
+		 ('ccm', 'CCM', 'execute_failok', 'ccm',        _ccm_key),
+		 ('ccm', 'CCM', 'stream',         'ccm stream', _ccm_stream_key),
+		 ('rtc', 'CLI', 'execute',        'lscm',       _cli_key),
+		 ('rtc', 'CLI', '_run',           'lscm',       _cli_run_key),
+		 ('rtc', 'RTC', 'do_curl',        'rest',       _curl_key)]
+
+class _Trace(object):
+	'common hook installation for Recorder and Player'
+	def __init__(self, path):
+		self.path = path
+		self._lock = threading.Lock()
+		self._local = threading.local()
+		self._saved = list()
+	def install(self, extra=()):
+		'''
+		install hooks, plus extra ones: [(class or module, name, kind, key function), ...]
+		'''
+		targets = [(getattr(__import__(m), c), name, kind, keyfn) for m, c, name, kind, keyfn in hooks]
+		for target, name, kind, keyfn in targets + list(extra):
+			orig = vars(target)[name]
+			self._saved.append((target, name, orig))
+			if name == 'stream':
+				setattr(target, name, self._wrap_stream(orig, kind, keyfn))
+			else:
+				setattr(target, name, self._wrap(orig, kind, keyfn))
+		return self
+	def uninstall(self):
+		for target, name, orig in reversed(self._saved):
+			setattr(target, name, orig)
+		self._saved = list()
+	def outermost(self):
+		return getattr(self._local, 'depth', 0) == 0
+	def nested(self, f, *args, **kwargs):
+		self._local.depth = getattr(self._local, 'depth', 0) + 1
+		try:
+			return f(*args, **kwargs)
+		finally:
+			self._local.depth -= 1
+
+class Recorder(_Trace):
+	def __init__(self, path):
+		_Trace.__init__(self, path)
+		self._f = gzip.open(path, 'wb')
+		self._t0 = time.time()
+		self.calls = 0
+	def write(self, kind, key, t, seconds, result=None, error=None):
+		if error is not None:
+			try:
+				cPickle.dumps(error, cPickle.HIGHEST_PROTOCOL)
+			except Exception:
+				error = TraceError(str(error))
+		rec = {'kind': kind, 'key': key, 't': t - self._t0, 'seconds': seconds,
+			   'result': result, 'error': error}
+		with self._lock:
+			cPickle.dump(rec, self._f, cPickle.HIGHEST_PROTOCOL)
+			self.calls += 1
+	def _wrap(self, orig, kind, keyfn):
+		recorder = self
+		def recorded(*args, **kwargs):
+			if not recorder.outermost():
+				return orig(*args, **kwargs)
+			key, t0 = keyfn(*args, **kwargs), time.time()
+			try:
+				r = recorder.nested(orig, *args, **kwargs)
+			except Exception, e:
+				recorder.write(kind, key, t0, time.time() - t0, error=e)
+				raise
+			recorder.write(kind, key, t0, time.time() - t0, result=r)
+			return r
+		return recorded
+	def _wrap_stream(self, orig, kind, keyfn):
+		recorder = self
+		def recorded(*args, **kwargs):
+			key, t0, chunks, error = keyfn(*args, **kwargs), time.time(), list(), None
+			try:
+				for chunk in orig(*args, **kwargs):
+					chunks.append(chunk)
+					yield chunk
+			except Exception, e:
+				error = e
+				raise
+			finally:
+				# also when the consumer stops early (GeneratorExit, e.g. next(query)):
+				# replay then returns what was consumed
+				recorder.write(kind, key, t0, time.time() - t0, result=''.join(chunks), error=error)
+		return recorded
+	def close(self):
+		self.uninstall()
+		self._f.close()
+		log.info('recorded %d calls in "%s"' % (self.calls, self.path))
+
+class Player(_Trace):
+	'''
+	answers hooked calls from trace; with realtime set, each call takes
+	as long as it did when recorded.
+	'''
+	def __init__(self, path, realtime=False):
+		_Trace.__init__(self, path)
+		self.realtime = realtime
+		self._calls = dict()			# (kind, key) -> [record, ...], in recorded order
+		f = gzip.open(path, 'rb')
+		n = 0
+		try:
+			while True:
+				try:
+					rec = cPickle.load(f)
+				except EOFError:
+					break
+				self._calls.setdefault((rec['kind'], rec['key']), list()).append(rec)
+				n += 1
+		finally:
+			f.close()
+		for calls in self._calls.values():
+			calls.reverse()
+		log.info('loaded %d calls from "%s"' % (n, path))
+	def next(self, kind, key):
+		with self._lock:
+			try:
+				rec = self._calls[(kind, key)].pop()
+			except (KeyError, IndexError):
+				raise TraceError('no (more) recorded %s calls for "%s"' % (kind, key))
+		if self.realtime:
+			time.sleep(rec['seconds'])
+		return rec
+	def _wrap(self, orig, kind, keyfn):
+		player = self
+		def replayed(*args, **kwargs):
+			rec = player.next(kind, keyfn(*args, **kwargs))
+			if rec['error'] is not None:
+				raise rec['error']
+			return rec['result']
+		return replayed
+	def _wrap_stream(self, orig, kind, keyfn):
+		player = self
+		def replayed(*args, **kwargs):
+			rec = player.next(kind, keyfn(*args, **kwargs))
+			if rec['result']:
+				yield rec['result']
+			if rec['error'] is not None:
+				raise rec['error']
+		return replayed
+	def unused(self):
+		'return number of recorded calls that were not replayed'
+		return sum([len(calls) for calls in self._calls.values()])
+	def close(self):
+		self.uninstall()
+		log.info('replay finished, %d recorded calls unused' % self.unused())
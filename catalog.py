@@ -0,0 +1,60 @@
+'''
+persistent catalog of a release's baselines, for continuous sync
+'''
+import time
+import logging
+from datetime import datetime as dt
+from mtconfig import ConfigError
+from progress import load_status, save_status
+
+log = logging.getLogger('catalog')
+
+class BaselineCatalog(object):
+	'''
+	Baselines of a release seen so far, oldest first, with their creation
+	times, and the last one migrated to RTC.
+
+	The catalog is persisted to path (if any) whenever it changes, so a
+	sync restarts where it left off, and only needs to ask CCM for
+	baselines created since the newest one it knows.
+	'''
+	def __init__(self, path, release):
+		self.path, self.release = path, release
+		self.baselines = list()			# [(name, create time in seconds since the epoch)]
+		self.migrated = None
+		state = load_status(path)
+		if state:
+			if state['release'] != release:
+				raise ConfigError('sync state "%s" is for release "%s", not "%s"' % (path, state['release'], release))
+			self.baselines = [tuple(bl) for bl in state['baselines']]
+			self.migrated = state['migrated']
+			log.info('loaded baseline catalog "%s": %d baselines, last migrated "%s"'
+					 % (path, len(self.baselines), self.migrated))
+		self._names = set([name for name, t in self.baselines])
+	def save(self):
+		save_status(self.path, {'release':   self.release,
+								'baselines': self.baselines,
+								'migrated':  self.migrated})
+	def __contains__(self, baseline):
+		return baseline in self._names
+	def newest(self):
+		'return creation time (datetime) of the newest baseline, or None if there are none'
+		return dt.fromtimestamp(self.baselines[-1][1]) if self.baselines else None
+	def add(self, records):
+		'add baselines (records with displayname and create_time, oldest first) not yet in catalog, return their names'
+		new = list()
+		for r in records:
+			if r.displayname not in self._names:
+				self.baselines.append((r.displayname, time.mktime(r.create_time.timetuple())))
+				self._names.add(r.displayname)
+				new.append(r.displayname)
+		if new:
+			self.save()
+		return new
+	def set_migrated(self, baseline):
+		self.migrated = baseline
+		self.save()
+	def pending(self):
+		'return baselines created after the last migrated one'
+		names = [name for name, t in self.baselines]
+		return names[names.index(self.migrated) + 1:]
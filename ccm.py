@@ -1,12 +1,17 @@
 '''
 CM/Synergy
 '''
-import os, os.path, re, StringIO, subprocess, sys
+import os, os.path, re, StringIO, subprocess, sys, tempfile, time
 import pdb
-import logging as log
+import logging
 from pprint import *
 from datetime import datetime as dt
 from retry import retry
+from limiter import limited
+import limiter
+from mtlog import Lazy
+
+log = logging.getLogger('ccm')
 
 class CCMError(Exception):
 	pass
@@ -15,7 +20,57 @@ def remove_dcm_prefix(name):
 	m = re.compile(r'(\w+=)?(.*)').match(name)
 	return m.group(2) if m else ''
 
+# query output delimiters: ASCII unit and record separators never occur in
+# CCM attribute values, unlike '|', ',' or newlines (think task_description).
+FIELD_SEP = '\x1f'
+RECORD_SEP = '\x1e'
+
+def ccm_time(text):
+	'convert CCM time attribute (e.g. create_time) to datetime'
+	return dt.strptime(text.strip(), '%c')
+
+def ccm_list(text):
+	'convert comma-separated CCM attribute (e.g. task) to tuple'
+	return tuple([t.strip() for t in text.split(',') if t.strip()])
+
+# attribute-specific conversions used by CCM.query; all other attributes are str
+attr_types = {'create_time':   ccm_time,
+			  'modify_time':   ccm_time,
+			  'complete_time': ccm_time,
+			  'task':          ccm_list}
+
+class Record(object):
+	'''
+	query result, one per CCM object.
+
+	subclasses are generated per attribute list by record_type() and
+	store values in __slots__, i.e. r.displayname, r.create_time, ...
+	'''
+	__slots__ = ()
+	def __init__(self, *values):
+		for k, v in zip(self.__slots__, values):
+			setattr(self, k, v)
+	def __iter__(self):
+		return iter([getattr(self, k) for k in self.__slots__])
+	def __repr__(self):
+		return '%s(%s)' % (self.__class__.__name__,
+						   ', '.join(['%s=%r' % (k, getattr(self, k)) for k in self.__slots__]))
+
+_record_types = dict()
+def record_type(attrs):
+	'return (cached) Record subclass for attribute list'
+	attrs = tuple(attrs)
+	try:
+		return _record_types[attrs]
+	except KeyError:
+		rt = type('Record', (Record,), {'__slots__': attrs})
+		_record_types[attrs] = rt
+		return rt
+
 class CCM(object):
+	query_chunk = 64				# max. number of OR'ed terms per query expression
+	stream_chunk = 65536			# bytes read from ccm standard output at a time
+	query_tries, query_delay = 9, 8	# as for execute (see _retried)
 	def __init__(self, server=('sausatlccmdb1', '/data/ccmdb/atl_client_db'), ccm='ccm'):
 		self.server, self.ccm = server, ccm
 		self.ccm_addr = os.getenv('CCM_ADDR')
@@ -27,23 +82,24 @@ class CCM(object):
 		else:
 			log.debug('using existing CCM session, CCM_ADDR=%s' % self.ccm_addr)
 	@retry(CCMError, tries=9, delay=8, backoff=2, logger=log)
+	@limited('ccm', ignore=(CCMError,))
 	def execute(self, cmd, ccm_opts='', ignore_out = None, ignore_err = None):
 		'execute ccm command line, ignoring certain errors that match ignore_out or ignore_err patterns'
 		cl = '%s %s %s' % (self.ccm, ccm_opts, cmd)
-		log.info('starting CCM CLI command: %s' % cl)
+		log.info('starting CCM CLI command: %s', cl)
 		p = subprocess.Popen(cl, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
 		o, e = p.communicate()
 		if p.returncode != 0:
 			# special-case handling for certain CCM errors...
 			if ignore_err and re.compile(ignore_err).search(e):
 				'standard error pattern matches, ignore this error'
-				log.error('error in CCM CLI command "%s", ignoring:\nstandard output: <<%s>>\nstandard error: <<%s>>"'
-						  % (cmd, o, e))
+				log.error('error in CCM CLI command "%s", ignoring:\nstandard output: <<%s>>\nstandard error: <<%s>>"',
+						  cmd, o, e)
 				return e
 			elif ignore_out and re.compile(ignore_out).search(o):
 				'standard output pattern matches, ignore this error'
-				log.error('error in CCM CLI command "%s", ignoring:\nstandard output: <<%s>>\nstandard error: <<%s>>"'
-						  % (cmd, o, e))
+				log.error('error in CCM CLI command "%s", ignoring:\nstandard output: <<%s>>\nstandard error: <<%s>>"',
+						  cmd, o, e)
 				return o
 			else:
 				# CCM does not consistently show errors on standard error, sometimes it
@@ -52,19 +108,142 @@ class CCM(object):
 							   % (cmd, o, e))
 		log.info('back from CCM CLI command.')
 		return o
+	@limited('ccm')
 	def execute_failok(self, cmd, ccm_opts=''):
 		cl = '%s %s %s' % (self.ccm, ccm_opts, cmd)
-		log.info('starting CCM CLI command: %s' % cl)
+		log.info('starting CCM CLI command: %s', cl)
 		p = subprocess.Popen(cl, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
 		o, e = p.communicate()
 		if p.returncode != 0:
-			log.error('failed to execute CCM CLI command "%s" (ignoring):\nstandard output: <<%s>>\nstandard error: <<%s>>"'
-					  % (cmd, o, e))
+			log.error('failed to execute CCM CLI command "%s" (ignoring):\nstandard output: <<%s>>\nstandard error: <<%s>>"',
+					  cmd, o, e)
 			return None
 		log.info('back from CCM CLI command.')
 		return o
-	def text2list(self, text):
-		return [l.rstrip() for l in text.split('\n') if l]
+	def stream(self, cmd, ccm_opts=''):
+		'''
+		execute ccm command line, yielding standard output in chunks as it
+		arrives; raise CCMError on failure (after all output).
+		'''
+		cl = '%s %s %s' % (self.ccm, ccm_opts, cmd)
+		log.info('starting CCM CLI command: %s', cl)
+		# a failing ccm command is no sign of a congested server (think
+		# failok queries); only failures to run ccm lower the limit
+		with limiter.get('ccm').slot(ignore=(CCMError,)):
+			err = tempfile.TemporaryFile()
+			p = subprocess.Popen(cl, shell=True, stdout=subprocess.PIPE, stderr=err)
+			fd = p.stdout.fileno()
+			try:
+				while True:
+					chunk = os.read(fd, self.stream_chunk)
+					if not chunk:
+						break
+					yield chunk
+			finally:
+				p.stdout.close()
+				p.wait()
+			err.seek(0)
+			e = err.read()
+			err.close()
+			if p.returncode != 0:
+				raise CCMError('failed to execute CCM CLI command "%s":\nstandard error: <<%s>>"'
+							   % (cmd, e))
+			log.info('back from CCM CLI command.')
+	def query(self, expr, attrs, query_opts='-u -ns', types=None, chunk=None, failok=False):
+		'''
+		run "ccm query", return generator of records (see record_type), one per object.
+
+		expr is either a query expression, or a list of expressions to be
+		OR'ed together, in which case no more than chunk (default:
+		self.query_chunk) of them are sent per "ccm query" command.
+
+		attrs is the list of attributes to fetch, e.g. ['displayname', 'create_time'].
+		values are converted per types (default: attr_types); "<void>" becomes None.
+
+		if failok is set, failing queries are logged and skipped; otherwise
+		they are retried like execute (see _retried).
+
+		output is parsed incrementally, so memory use is bounded by the
+		largest record, not by the size of the result set. The exception is
+		failok: as ccm reports errors only after its output, each chunk is
+		then parsed in full before any of it is returned, so a failing
+		chunk returns nothing, and its terms can be tried separately.
+		'''
+		conv = dict(attr_types)
+		conv.update(types or {})
+		conv = [conv.get(a, str) for a in attrs]
+		rt = record_type(attrs)
+		fmt = FIELD_SEP.join(['%%%s' % a for a in attrs]) + RECORD_SEP
+		if isinstance(expr, basestring):
+			chunks = [[expr]]
+		else:
+			terms = list(expr)
+			n = chunk or self.query_chunk
+			chunks = [terms[i:i+n] for i in xrange(0, len(terms), n)]
+		for terms in chunks:
+			cmd = '''query %s "%s" -f '%s' ''' % (query_opts, ' or '.join(terms), fmt)
+			try:
+				if failok:
+					# failing terms are not transient errors, do not retry them
+					records = list(self._retried(cmd, rt, conv, tries=1))
+				else:
+					records = self._retried(cmd, rt, conv)
+				for r in records:
+					yield r
+			except CCMError, s:
+				if not failok:
+					raise
+				if len(terms) == 1:
+					log.error('%s (ignoring)' % s)
+					continue
+				# CCM fails the whole expression if any term fails; fall back to
+				# one term at a time so the failing term does not hide the others.
+				log.error('%s (retrying %d terms separately)' % (s, len(terms)))
+				for t in terms:
+					for r in self.query(t, attrs, query_opts, types, failok=True):
+						yield r
+	def _retried(self, cmd, rt, conv, tries=None):
+		'''
+		same as _records, but a failing command is retried (up to tries times,
+		default: self.query_tries, with exponential backoff) as long as it has
+		not returned any records; it then starts over from scratch.
+		'''
+		tries, delay = tries or self.query_tries, self.query_delay
+		while True:
+			n = 0
+			try:
+				for r in self._records(cmd, rt, conv):
+					n += 1
+					yield r
+				return
+			except CCMError, e:
+				tries -= 1
+				if n or tries < 1:
+					raise
+				log.warning('%s, Retrying in %d seconds...' % (e, delay))
+				time.sleep(delay)
+				delay *= 2
+	def _records(self, cmd, rt, conv):
+		'parse records of a single ccm command (e.g. query) incrementally from streamed output'
+		pending = ''
+		for data in self.stream(cmd):
+			recs = (pending + data).split(RECORD_SEP)
+			pending = recs.pop()
+			for r in recs:
+				# ccm terminates each record (after RECORD_SEP) with a newline
+				if r.startswith('\n'):
+					r = r[1:]
+				values = r.split(FIELD_SEP)
+				if len(values) != len(conv):
+					log.error('invalid record in query output (ignoring): %r' % r)
+					continue
+				yield rt(*[None if v == '<void>' else c(v) for c, v in zip(conv, values)])
+	def task_objects(self, task, attrs=('objectname',)):
+		'return list of records (see query) of the objects associated with task'
+		attrs = list(attrs)
+		conv = [attr_types.get(a, str) for a in attrs]
+		fmt = FIELD_SEP.join(['%%%s' % a for a in attrs]) + RECORD_SEP
+		return list(self._retried("task -show objects -u '%s' -f '%s'" % (task, fmt), record_type(attrs), conv))
 	def baseline_compare(self, bl1, bl2, pjt_name):
 		'''
 		return (a, r) where, in order to get a working project at bl1 to bl2,
@@ -74,20 +253,20 @@ class CCM(object):
 		  format of a and r is:
 		  ['cup=25637', 'cup=26080', ...]
 		'''
-		def text2tasks(text):
-			tasks = set()
-			# split text at '\n' then split lines at ',' to get list of task ids;
-			for v in [u.split(',') for u in [t.strip() for t in text.split('\n') if t]]:
-				tasks.update(v)
-			return tasks
-		cmd_tmpl = '''query "recursive_is_member_of('%s','none')" -u -ns -f "%%task"'''
 		blp1 = self.baseline_project(bl1, pjt_name)
 		blp2 = self.baseline_project(bl2, pjt_name)
-		tasks_in_bl1 = text2tasks(self.execute(cmd_tmpl % blp1))
-		tasks_in_bl2 = text2tasks(self.execute(cmd_tmpl % blp2))
+		tasks_in_bl1 = self.project_tasks(blp1)
+		tasks_in_bl2 = self.project_tasks(blp2)
 		tasks2add = tasks_in_bl2 - tasks_in_bl1
 		tasks2remove = tasks_in_bl1 - tasks_in_bl2
 		return (tasks2add, tasks2remove)
+	def project_tasks(self, project):
+		'return set of tasks associated with members of project hierarchy'
+		tasks = set()
+		for r in self.query("recursive_is_member_of('%s','none')" % project, ['task']):
+			if r.task:
+				tasks.update(r.task)
+		return tasks
 	def baseline_compare_x(self, bl1, bl2):
 		'''
 		another flavor of baseline_compare that uses "ccm baseline -compare"
@@ -145,17 +324,15 @@ class CCM(object):
 									 % baseline).split('\n')
 					if p]
 		for proj in bl_projs:
-			hier = [p.strip()
-					for p in self.execute('''query "hierarchy_project_members('%s', none)" -u -f '%%displayname' '''
-									 % proj).split('\n')
-					if p]
-			if len(hier) == len(bl_projs):
+			hier = len([r for r in self.query("hierarchy_project_members('%s', none)" % proj, ['displayname'])])
+			if hier == len(bl_projs):
 				return proj
 		if len(bl_projs) == 1:
 			return bl_projs[0]
 		return None
 
 class Project(object):
+	task_spec_re = re.compile(r'Task ([^:]+):')
 	def __init__(self, spec, ccm):
 		self._spec = spec
 		self._ccm = ccm
@@ -168,13 +345,12 @@ class Project(object):
 		t0 = dt(1970, 1, 1)
 		baselines = list()
 		if not raw:
-			using_bl_cmd = ("baseline -list -release '%s' -purpose 'System Testing' -ns -u -f '%%displayname|%%create_time'"
-							% self.release)
-			using_query_cmd = '''query -t baseline "release='%s' and (%s)" -ns -u -f '%%displayname|%%create_time' ''' % (self.release, " or ".join(["has_purpose('%s')" % p for p in purposes]))
-			raw = self._ccm.execute(using_query_cmd).split('\n')
-		else:
-			raw = raw.split('\n')
-		for bl in raw:
+			expr = "release='%s' and (%s)" % (self.release, " or ".join(["has_purpose('%s')" % p for p in purposes]))
+			for bl in self._ccm.query(expr, ['displayname', 'create_time'], query_opts='-t baseline -ns -u'):
+				assert bl.create_time > t0
+				baselines.append(bl.displayname)
+			return baselines
+		for bl in raw.split('\n'):
 			x = bl.split('|')
 			try:
 				nm, t1 = x[0], dt.strptime(x[1].strip(), '%c')
@@ -184,6 +360,20 @@ class Project(object):
 			except IndexError:
 				log.error('invalid line in baseline list (ignoring): "%s"' % str(x))
 		return baselines
+	def baseline_records(self, purposes, since=None):
+		'''
+		return records (displayname, create_time) of baselines in release,
+		oldest first; if since (datetime) is set, only of those created no
+		earlier than since, so the cost does not depend on how many older
+		baselines there are.
+		'''
+		expr = "release='%s' and (%s)" % (self.release, " or ".join(["has_purpose('%s')" % p for p in purposes]))
+		if since:
+			# create_time has a resolution of one second, hence >= (callers
+			# drop the baselines they already know)
+			expr += " and create_time>=time('%s')" % since.strftime('%c')
+		return sorted(self._ccm.query(expr, ['displayname', 'create_time'], query_opts='-t baseline -ns -u'),
+					  key=lambda bl: bl.create_time)
 	def baseline_align(self, baseline):
 		log.info('aligning CCM project with baseline "%s"' % baseline)
 		bl_proj = self._ccm.baseline_project(baseline, None)
@@ -199,24 +389,24 @@ class Project(object):
 			try:
 				r = self._ccm.execute("update_properties -recurse -remove -tasks '%s' '%s'"
 									  % (','.join(tasks), self._spec), ignore_err=r'(?ms)not modifiable by you')
-				log.debug(r)
+				log.debug('%s', r)
 			except CCMError, s:
-				log.debug('one or more of the following tasks could not be removed:\n%s\n<<%s>>'
-						  % (pformat(tasks), s))
+				log.debug('one or more of the following tasks could not be removed:\n%s\n<<%s>>',
+						  Lazy(pformat, tasks), s)
 			self.update()
 	def update(self):
 		r = self._ccm.execute("update -r -p '%s'" % self._spec)
-		log.debug(r)
+		log.debug('%s', r)
 		return r
 	def remove_all_tasks(self):
 		raw = self._ccm.execute("update_properties -recurse -show tasks -u '%s'" % self._spec).split('\n')
 		tasks2remove = list()
 		for l in raw:
 			try:
-				m = re.compile(r'Task ([^:]+):').match(l)
+				m = self.task_spec_re.match(l)
 				tasks2remove.append(m.group(1))
 			except AttributeError:
-				log.debug('no task_spec in: "%s"' % l)
+				log.debug('no task_spec in: "%s"', l)
 		self.remove_tasks(tasks2remove)
 
 def test():
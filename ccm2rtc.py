@@ -1,40 +1,106 @@
 #!/usr/bin/env python
 '''
 migrate a CCM release to an RTC stream
+
+usage:
+  ccm2rtc [options] <user> <password> <config-file>   migrate
+  ccm2rtc sync [options] <user> <password> <config-file>
+                                                      migrate, then keep migrating
+                                                      new baselines as they appear
+  ccm2rtc status <config-file>                        show migration status
+  ccm2rtc plan show <config-file>                     show baselines still to be migrated
+  ccm2rtc config check <config-file>                  validate configuration file
+  ccm2rtc index show <config-file>                    list migrated tasks: task, change set,
+                                                      work item, baseline, delivery time
+
+migration options:
+  -i                  interactive: pause before each baseline
+  --record <trace>    record all CCM, lscm and REST calls in trace file
+  --replay <trace>    answer CCM, lscm and REST calls from trace file, offline
+  --realtime          replay at recorded speed (default: as fast as possible)
+
+status, plan, config and index commands only read local files; they neither
+import the CCM and RTC modules nor contact either server.
+
+to replay a trace, use a configuration whose ccm.work_area and rtc.sandbox
+are scratch directories, and whose membership index, task index and status
+file (if any) are in the state they were in when the trace was recorded.
 '''
 
-import os, sys, re, tempfile, os.path
+import os, sys, re, subprocess, tempfile, time, os.path
 from pprint import *
 from time import sleep
-
-# configure logging before any RTC- or CCM-dependent modules
-import logging as log
-log.basicConfig(level=log.DEBUG, format='%(asctime)s %(message)s')
-
-from rtc import *
-from ccm import *
-
-class mt_config:
-	'container for configuration elements, specified externally'
-	class ccm:
-		pass
-	class rtc:
-		pass
+import logging
+
+from mtconfig import mt_config, load_config, check_config, ConfigError
+from progress import Progress, load_status, plan
+from catalog import BaselineCatalog
+from mtlog import Lazy
+from sharding import Shard, shard_settings, task_order
+import limiter, mtlog, sharding
+
+log = logging.getLogger('ccm2rtc')
+
+def load_backends():
+	'import CCM and RTC modules (and their dependencies, e.g. pycurl) on first use'
+	global RTC, CLI, WorkItem, RTCError, ChangeSetNotFound, CCM, CCMError, Project, remove_dcm_prefix, MembershipIndex, Recorder, Player, verify
+	from rtc import RTC, CLI, WorkItem, RTCError, ChangeSetNotFound
+	from ccm import CCM, CCMError, Project, remove_dcm_prefix
+	from membership import MembershipIndex
+	from calltrace import Recorder, Player
+	import verify
 
 def log_chdir(d):
-	log.debug('entering "%s"' % d)
+	log.debug('entering "%s"', d)
 	os.chdir(d)
 
+def shell_key(cmd):
+	'calltrace key of a shell command: the same when recorded and when replayed'
+	# the -cnewer reference file (see copy_task) is a new temporary file every time
+	return re.sub(r'-cnewer "[^"]*"', '-cnewer <epoch>', cmd)
+
 def execute(cmd):
 	'general function for executing shell commands and capturing output'
-	log.info('starting bash command: "%s"' % cmd)
+	log.info('starting bash command: "%s"', cmd)
 	p = subprocess.Popen(cmd, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
 	o, e = p.communicate()
 	assert p.returncode == 0, 'failure in subprocess command "%s"\nstdout:\n%sstderr:\n%s\n' % (cmd, o, e)
-	log.info('back from bash command "%s"' % cmd)
+	log.info('back from bash command "%s"', cmd)
 	return o
 	
-def add_tasks(ccm_project, tasks, cli, work_item, rtc, project_rtc, work_area):
+def fetch_task_info(ccm_project, task, progress):
+	'return metadata of task, or None if it is excluded'
+	# fetch task status and metadata with a single query
+	with progress.stage(task, 'info'):
+		info = next(ccm_project._ccm.query("task('%s')" % task,
+										   ['status', 'task_synopsis', 'task_description', 'resolver', 'cr_number']), None)
+	if info is None:
+		raise CCMError('task "%s" not found' % task)
+
+	# skip excluded tasks, if any
+	if re.compile(r'excluded').search(info.status or ''):
+		log.debug("skipping 'excluded' task '%s'" % task)
+		return None
+
+	return dict([('synopsis',    (info.task_synopsis or '').strip()),
+				 ('description', info.task_description or ''),
+				 ('resolver',    (info.resolver or '').strip()),
+				 ('cr_number',   (info.cr_number or '').strip())])
+
+def bring_in_task(ccm_project, task, progress):
+	'''
+	bring task into CCM working project; return the file marking the time
+	just before the work area was updated (see copy_task)
+	'''
+	with progress.stage(task, 'update'):
+		log.debug('%s', ccm_project._ccm.execute("update_properties -recurse -add -tasks '%s' '%s'" % (task, ccm_project._spec),
+										   ignore_err = r'(?ms)Failed to add any task.*cannot be changed'))
+		tf = tempfile.NamedTemporaryFile()
+		sleep(1.57)						# address odd behavior of find -newer/-cnewer, below
+		updt = ccm_project.update()
+	return tf
+
+def add_tasks(ccm_project, tasks, cli, work_item, rtc, project_rtc, work_area, progress, task_index, baseline):
 	'bring tasks into CCM working project, migrate to RTC stream'
 	if not tasks:
 		log.info('no tasks to add on top of current baseline "%s"' % ccm_project.baseline_project)
@@ -43,48 +109,102 @@ def add_tasks(ccm_project, tasks, cli, work_item, rtc, project_rtc, work_area):
 		# even though are not migrating any tasks for this baseline.
 		#
 		log_chdir(mt_config.rtc.sandbox)
-	for task in tasks:
-		# skip excluded tasks, if any
-		status = ccm_project._ccm.execute("query \"task('%s')\" -u -f %%status" % task)
-		if re.compile(r'excluded').search(status):
-			log.debug("skipping 'excluded' task '%s'" % task)
-			continue
-
-		# bring task into CCM working project.
-		log.debug(ccm_project._ccm.execute("update_properties -recurse -add -tasks '%s' '%s'" % (task, ccm_project._spec),
-										   ignore_err = r'(?ms)Failed to add any task.*cannot be changed'))
-		tf = tempfile.NamedTemporaryFile()
-		sleep(1.57)						# address odd behavior of find -newer/-cnewer, below
-		updt = ccm_project.update()
-
-		# FIXME
-		# task_info could be fetched more efficiently:
-		#  1. Issue a single "task -show info" instead of three and parse fields from output.
-		#  2. Fetch task info on-demand, only if RTC determines that there are changes to check in.
-		#     (pass a call-back function? lazy evaluation?)
-		task_info = dict([('synopsis',    ccm_project._ccm.execute("task -show info '%s' -u -format '%%task_synopsis'" % task).strip()),
-						  ('description', ccm_project._ccm.execute("task -show info '%s' -u -format '%%task_description'" % task)),
-						  ('resolver',    ccm_project._ccm.execute("task -show resolver '%s'" % task).strip()),
-						  ('cr_number',   ccm_project._ccm.execute("task -show info '%s' -u -format '%%cr_number'" % task).strip())])
-		migrate_task(cli, task, work_item, rtc, task_info, project_rtc, epoch=tf, ccm_project=ccm_project)
-
-def migrate_task(rtc_cli, task, work_item, rtc, task_info, project_rtc, epoch, ccm_project):
-	'convert task objects into new change set and deliver'
+	for task in sorted(tasks, key=task_order):
+		with progress.task(task):
+			task_info = fetch_task_info(ccm_project, task, progress)
+			if task_info is None:
+				continue
+			tf = bring_in_task(ccm_project, task, progress)
+			migrate_task(cli, task, work_item, rtc, task_info, project_rtc, epoch=tf, ccm_project=ccm_project,
+						 progress=progress, task_index=task_index, baseline=baseline)
+
+def add_tasks_sharded(ccm_project, tasks, shards, pool, work_item, rtc, project_rtc, progress, task_index, baseline):
+	'''
+	same as add_tasks, but tasks that change disjoint sets of objects are
+	checked in concurrently, one per shard (shards[0] is the migration
+	workspace and sandbox, see run_migration).
+
+	tasks are scheduled in waves (see sharding.waves). Within a wave, the
+	CCM side of each task (update, copy into its shard's sandbox) runs here,
+	one task after the other, while the RTC side (check-in, work item,
+	annotation) runs in pool. At the end of the wave, change sets are
+	delivered in CCM task order.
+
+	a task is done (for progress) once its change set is delivered; it is
+	credited with the time since the previous task of its wave was done,
+	so that task times add up to the time the waves take.
+	'''
+	ccm = ccm_project._ccm
+	tasks = sorted(tasks, key=task_order)
+	objects = pool.map(lambda t: [tuple(r) for r in ccm.task_objects(t, ['name', 'type', 'instance'])], tasks)
+	schedule = sharding.waves(tasks, sharding.conflicts(dict(zip(tasks, objects))), len(shards))
+	log.info('checking in %d tasks in %d waves on %d shards', len(tasks), len(schedule), len(shards))
+	for wave in schedule:
+		t0 = time.time()
+		# catch up with change sets delivered by earlier waves
+		pool.map(lambda shard: shard.accept(), shards[:len(wave)])
+		pending = list()
+		for task, shard in zip(wave, shards):
+			task_info = fetch_task_info(ccm_project, task, progress)
+			if task_info is None:
+				pending.append((task, shard, None))
+				continue
+			tf = bring_in_task(ccm_project, task, progress)
+			copy_task(task, tf, shard.sandbox, progress)
+			pending.append((task, shard, pool.apply_async(checkin_task, (shard.cli, task, work_item, rtc, task_info, project_rtc,
+																		  ccm_project, progress, task_index, baseline,
+																		  shard.sandbox, shard.task_pred_dir))))
+		for task, shard, r in pending:
+			if r and r.get():
+				with progress.stage(task, 'deliver'):
+					shard.deliver()
+				task_index.delivered([task])
+			now = time.time()
+			progress.task_done(task, now - t0)
+			t0 = now
+	# the migration sandbox is where verification and snapshots happen
+	shards[0].accept()
+	log_chdir(mt_config.rtc.sandbox)
 
-	# determine what, if anything changed as a result of bringing in this task.
+def copy_task(task, epoch, sandbox, progress):
+	'copy what changed in the work area as a result of bringing in task to sandbox'
 	#
 	# FIXME: for some reason, "-cnewer" works better than "-newer" below.
 	#        is this because the resolution on -newer is 1 second, or what?
 	#        most likely this is due to CCM's subterfuge regarding file
 	#        mod times in work areas...
 	#
-	log_chdir(mt_config.ccm.work_area)
-	cpio = execute('find * ! -type d -cnewer "%s" | cpio -pdmuv "%s"'
-				   % (epoch.name, mt_config.rtc.sandbox))
+	with progress.stage(task, 'copy'):
+		log_chdir(mt_config.ccm.work_area)
+		cpio = execute('find * ! -type d -cnewer "%s" | cpio -pdmuv "%s"'
+					   % (epoch.name, sandbox))
+
+def migrate_task(rtc_cli, task, work_item, rtc, task_info, project_rtc, epoch, ccm_project, progress, task_index, baseline):
+	'convert task objects into new change set and deliver'
+
+	# determine what, if anything changed as a result of bringing in this task.
+	copy_task(task, epoch, mt_config.rtc.sandbox, progress)
 	log_chdir(mt_config.rtc.sandbox)
-	if not re.compile(r'(?m)Unresolved:').search(rtc_cli.execute('status -w')):
+	csid = checkin_task(rtc_cli, task, work_item, rtc, task_info, project_rtc, ccm_project, progress, task_index, baseline)
+
+	# deliver changeset
+	if csid:
+		with progress.stage(task, 'deliver'):
+			rtc_cli.deliver()
+		task_index.delivered([task])
+
+def checkin_task(rtc_cli, task, work_item, rtc, task_info, project_rtc, ccm_project, progress, task_index, baseline,
+				 sandbox=None, task_pred_dir=None):
+	'''
+	check in the changes of task copied to sandbox (default: current working
+	directory), with a work item for its metadata, and record both in
+	task_index; return the change set id, or None if the task changed nothing.
+	'''
+	with progress.stage(task, 'status'):
+		unresolved = rtc_cli.unresolved(cwd=sandbox)
+	if not unresolved:
 		log.info('no changes in CCM task "%s", no RTC changeset will be created' % task)
-		return
+		return None
 
 	# clean up any unicode bogosity in task_info strings
 	for k, v in task_info.items():
@@ -92,37 +212,46 @@ def migrate_task(rtc_cli, task, work_item, rtc, task_info, project_rtc, epoch, c
 
 	# save task object precedessors per CCM, since they are not 100% guaranteed to
 	# be the same as what is in RTC at the time the current task is brought in.
-	save_task_object_predecessors(ccm_project, task)
-
-	# create new changeset.
-	txt = rtc_cli.execute('checkin --delim-none .', scm_opts='-a n -u y')
-	log.debug(txt)
-	m = re.compile(r'(?m)Change sets:\W*\(([-_A-Za-z0-9]+)\)').search(txt)
-	if m:
-		csid = m.group(1)
-	else:
-		raise RTCError('unable to find changeset id in: \n%s' % txt)
+	with progress.stage(task, 'predecessors'):
+		save_task_object_predecessors(ccm_project, task, task_pred_dir)
 
-	# set changeset comment to CCM task id.
-	log.info(rtc_cli.execute('changeset comment "%s" "%s"' % (csid, task)))
+	# a task already delivered by an earlier run is checked in again all the
+	# same: skipping it would leave its changes in the sandbox, to end up in
+	# the next task's change set. The duplicate is reported, though.
+	known = task_index.get(task)
 
-	# associate changeset to common work item.
-	log.info(rtc_cli.execute('changeset associate "%s" "%s"' % (csid, work_item)))
-
-	# create new work item for task metadata.
-	wi = WorkItem(rtc, project_rtc)
-	wi.title(task_info['synopsis'])
-	desc = '[resolver: "%s"]<p>%s\n' % (task_info['resolver'], task_info['description'])
-	if re.compile(r'CSC[a-z]{2}\d{5}$').match(task_info['cr_number']):
-		wi.cdets(task_info['cr_number'])
+	# create new changeset.
+	with progress.stage(task, 'checkin'):
+		csid = rtc_cli.checkin(cwd=sandbox)
+	if known and known.changeset and known.delivered:
+		log.warning('duplicate change set %s for task "%s", which was delivered as change set %s (baseline "%s", %s)'
+					% (csid, task, known.changeset, known.baseline, time.ctime(known.delivered)))
+	task_index.checked_in(task, csid, baseline)
+
+	# create new work item for task metadata, unless an earlier run did.
+	if known and known.work_item:
+		log.info('task "%s" already has work item %s (change set %s, baseline "%s"), reusing it'
+				 % (task, known.work_item, known.changeset, known.baseline))
+		wi_id = known.work_item
 	else:
-		desc = '[migrated from CM/Synergy]<p>[cr_number (invalid CDETS): "%s"]<p>%s\n' % (task_info['cr_number'], desc)
-	wi.getset('dc:description', desc)
-	wi.flush()
-	log.info(rtc_cli.execute('changeset associate "%s" "%s"' % (csid, wi.id)))
-
-	# deliver changeset
-	log.info(rtc_cli.execute('deliver'))
+		with progress.stage(task, 'work item'):
+			wi = WorkItem(rtc, project_rtc)
+			wi.title(task_info['synopsis'])
+			desc = '[resolver: "%s"]<p>%s\n' % (task_info['resolver'], task_info['description'])
+			if re.compile(r'CSC[a-z]{2}\d{5}$').match(task_info['cr_number']):
+				wi.cdets(task_info['cr_number'])
+			else:
+				desc = '[migrated from CM/Synergy]<p>[cr_number (invalid CDETS): "%s"]<p>%s\n' % (task_info['cr_number'], desc)
+			wi.getset('dc:description', desc)
+			wi.flush()
+		wi_id = wi.id
+		task_index.work_item(task, wi_id)
+
+	# set changeset comment to CCM task id, associate changeset to common
+	# work item and to task metadata work item.
+	with progress.stage(task, 'annotate'):
+		rtc_cli.annotate(csid, task, [work_item, wi_id], cwd=sandbox)
+	return csid
 
 def align_sandbox(rtc_cli, work_item, rtc, baseline):
 	'''
@@ -132,81 +261,301 @@ def align_sandbox(rtc_cli, work_item, rtc, baseline):
 	execute('rsync -av --exclude="%s/" --exclude=.jazz5/ --exclude=.jazzShed/ --delete "%s/" "%s"'
 			% (mt_config.rtc.ccm_versions, mt_config.ccm.work_area, mt_config.rtc.sandbox))
 	log_chdir(mt_config.rtc.sandbox)
-	if not re.compile(r'(?m)Unresolved:').search(rtc_cli.execute('status -w')):
+	if not rtc_cli.unresolved():
 		log.info('baselines match, no baseline alignment changeset will be created for "%s"' % baseline)
 		return
 	log.info('baseline alignment required for "%s"' % baseline)
-	txt = rtc_cli.execute('checkin --delim-none .', scm_opts='-a n -u y')
-	log.debug(txt)
-	m = re.compile(r'(?m)Change sets:\W*\(([-_A-Za-z0-9]+)\)').search(txt)
-	if m:
-		csid = m.group(1)
-	else:
-		log.error('unable to find alignment changeset id in: "%s" (ignoring)' % txt)
+	try:
+		csid = rtc_cli.checkin()
+	except ChangeSetNotFound, s:
+		log.error('%s (ignoring)' % s)
 		return
 
-	# set changeset comment to CCM task id.
-	log.info(rtc_cli.execute('changeset comment "%s" "baseline realignment: %s"' % (csid, baseline)))
-
-	# associate changeset to common work item.
-	log.info(rtc_cli.execute('changeset associate "%s" "%s"' % (csid, work_item)))
+	# set changeset comment to baseline, associate changeset to common work item.
+	rtc_cli.annotate(csid, 'baseline realignment: %s' % baseline, [work_item])
 
 	# deliver changeset
-	log.info(rtc_cli.execute('deliver'))
+	rtc_cli.deliver()
+
+def verify_sandbox(baseline, cache):
+	'''
+	compare CCM work area with RTC sandbox; depending on mt_config.migration.verify,
+	differences are logged ('warn') or abort the migration ('fail').
+	'''
+	if mt_config.migration.verify == 'off':
+		return
+	r = verify.compare(mt_config.ccm.work_area, mt_config.rtc.sandbox,
+					   excluded=[mt_config.rtc.ccm_versions], cache=cache)
+	if not r:
+		log.info('RTC sandbox matches CCM work area at "%s"', baseline)
+	elif mt_config.migration.verify == 'fail':
+		raise verify.VerifyError('RTC sandbox differs from CCM work area at "%s":\n%s' % (baseline, r))
+	else:
+		log.error('RTC sandbox differs from CCM work area at "%s" (ignoring):\n%s', baseline, r)
 
-def save_task_object_predecessors(project, task):
-	task_pred_dir = '%s/%s' % (mt_config.rtc.task_pred_dir, task)
+def save_task_object_predecessors(project, task, task_pred_dir=None):
+	task_pred_dir = '%s/%s' % (task_pred_dir or mt_config.rtc.task_pred_dir, task)
 	os.path.isdir(task_pred_dir) or os.makedirs(task_pred_dir)
 
-	objects = project._ccm.execute("task -show objects -u '%s' -f '%%objectname'" % task)
-	objects = project._ccm.text2list(objects)
-	log.info('saving predecessor objects for task "%s" in "%s":\n%s' % (task, mt_config.rtc.ccm_versions, pformat(objects)))
-	allpreds = list()
-	for obj in objects:
-		objpreds = project._ccm.execute_failok("query \"is_predecessor_of('%s')\" -u -f '%%objectname'" % obj)
-		if objpreds:
-			for pred in project._ccm.text2list(objpreds):
-				allpreds.append(pred)
+	objects = [r.objectname for r in project._ccm.task_objects(task)]
+	log.info('saving predecessor objects for task "%s" in "%s":\n%s', task, mt_config.rtc.ccm_versions, Lazy(pformat, objects))
+	allpreds, seen = list(), set()
+	for pred in project._ccm.query(["is_predecessor_of('%s')" % obj for obj in objects], ['objectname'], failok=True):
+		if pred.objectname not in seen:
+			seen.add(pred.objectname)
+			allpreds.append(pred.objectname)
 
 	for pred in allpreds:
 		project._ccm.execute('cat "%s" > "%s/%s"' % (pred, task_pred_dir, pred))
 
-def main():
+def usage():
+	sys.exit(__doc__.strip())
+
+def status_cmd(config):
+	load_config(config)
+	status = load_status(mt_config.migration.status_file)
+	if not status:
+		sys.exit('no migration status in "%s"' % mt_config.migration.status_file)
+	print 'state:     %s (pid %s)' % (status['state'], status['pid'])
+	print 'started:   %s' % time.ctime(status['started'])
+	print 'updated:   %s' % time.ctime(status['updated'])
+	print 'migrated:  %s' % status['migrated']
+	print 'current:   %s' % status['current']
+	# older status files lack remaining, eta, limits and slow
+	if status.get('remaining'):
+		print 'remaining: %d baselines, %d tasks' % tuple(status['remaining'])
+	if status.get('eta') is not None:
+		print 'eta:       %s (%.1f hours)' % (time.ctime(status['updated'] + status['eta']), status['eta'] / 3600)
+	for name, l in sorted(status.get('limits', {}).items()):
+		print 'limit:     %s %d (%d in flight, %d requests, %d errors)' % (name, l['limit'], l['inflight'], l['requests'], l['errors'])
+	for s in status.get('slow', [])[-5:]:
+		print 'slow:      %s "%s" %.1fs (mean %.1fs) at %s' % (s['kind'], s['name'], s['seconds'], s['mean'], time.ctime(s['time']))
+
+def plan_show_cmd(config):
+	load_config(config)
+	status = load_status(mt_config.migration.status_file)
+	if not status:
+		sys.exit('no migration plan in "%s"' % mt_config.migration.status_file)
+	index = None
+	if mt_config.ccm.membership_index:
+		from membership import MembershipIndex
+		index = MembershipIndex(mt_config.ccm.membership_index)
+	bls = status['baselines']
+	prev = status['migrated']
+	for bl in plan(status):
+		i = bls.index(bl)
+		if index and prev in index and bl in index:
+			a, r = index.compare(prev, bl)
+			print '%s\t+%d -%d tasks' % (bl, len(a), len(r))
+		elif i == 0:
+			# migrated is not one of the baselines (e.g. the status file is
+			# from another configuration): the plan starts from scratch
+			print '%s\tstarting baseline' % bl
+		else:
+			print '%s\t+%d tasks' % (bl, status['tasks'][i - 1])
+		prev = bl
+
+def index_show_cmd(config):
+	load_config(config)
+	if not mt_config.migration.task_index:
+		sys.exit('no task index configured in "%s"' % config)
+	from taskindex import TaskIndex
 	try:
-		'simple command line argument extraction'
-		if sys.argv[1] == "-i":
+		index = TaskIndex(mt_config.migration.task_index, readonly=True)
+	except IOError, e:
+		sys.exit(str(e))
+	for e in index.entries():
+		print '\t'.join([e.task, e.changeset or '-', e.work_item or '-', e.baseline or '-',
+						 time.ctime(e.delivered) if e.delivered else '-'])
+	index.close()
+
+def config_check_cmd(config):
+	problems = check_config(config)
+	for p in problems:
+		print p
+	if problems:
+		sys.exit(1)
+	print '%s: OK' % config
+
+def main():
+	commands = {('status',):          status_cmd,
+				('plan', 'show'):     plan_show_cmd,
+				('config', 'check'):  config_check_cmd,
+				('index', 'show'):    index_show_cmd}
+	args = tuple(sys.argv[1:])
+	for words, cmd in commands.items():
+		if args[:len(words)] == words:
+			if len(args) != len(words) + 1:
+				usage()
+			mtlog.configure(level='WARNING')
+			try:
+				cmd(args[-1])
+			except ConfigError, e:
+				sys.exit(str(e))
+			return
+	if args[:1] == ('sync',):
+		migrate(list(args[1:]), sync=True)
+	else:
+		migrate(list(args))
+
+def migrate(args, sync=False):
+	global sleep
+
+	'simple command line argument extraction'
+	baseline_advisor, record, replay, realtime = None, None, None, False
+	while args and args[0].startswith('-'):
+		opt = args.pop(0)
+		if opt == '-i':
 			baseline_advisor = raw_input
-			sys.argv = sys.argv[0:1] + sys.argv[2:]
+		elif opt == '--record' and args:
+			record = args.pop(0)
+		elif opt == '--replay' and args:
+			replay = args.pop(0)
+		elif opt == '--realtime':
+			realtime = True
 		else:
-			baseline_advisor = log.info
-		user, password, config = sys.argv[1], sys.argv[2], sys.argv[3]
-	except IndexError:
-		raise RTCError('usage: %s <user> <password> <config-file>' % sys.argv[0])
+			usage()
+	try:
+		user, password, config = args
+	except ValueError:
+		usage()
 
 	'load configuration'
-	execfile(config)
+	load_config(config)
 	mt_config.rtc.task_pred_dir = '%s/%s' % (mt_config.rtc.sandbox, mt_config.rtc.ccm_versions)
+	mtlog.configure(level=mt_config.migration.log_level, levels=mt_config.migration.log_levels,
+					cap=mt_config.migration.log_cap, spill_dir=mt_config.migration.log_spill_dir)
+	baseline_advisor = baseline_advisor or log.info
+	limiter.configure(mt_config.migration.limits)
+
+	load_backends()
+	# local shell commands (find/cpio, rsync) are traced too, so that a
+	# replay does not depend on the contents of the work area.
+	shell_hook = [(sys.modules[__name__], 'execute', 'shell', shell_key)]
+	if record:
+		trace = Recorder(record).install(shell_hook)
+	elif replay:
+		trace = Player(replay, realtime=realtime).install(shell_hook)
+		if not realtime:
+			sleep = lambda seconds: None
+	else:
+		trace = None
+	try:
+		if sync:
+			sync_migration(user, password, baseline_advisor)
+		else:
+			run_migration(user, password, baseline_advisor)
+	finally:
+		if trace:
+			trace.close()
 
-	log.info('configuration for this migration:\n%s\n%s' % (pformat(mt_config.ccm.__dict__), pformat(mt_config.rtc.__dict__)))
-
-	rtc = RTC(host=mt_config.rtc.host, root=mt_config.rtc.root, user=user, password=password)
-	cli = CLI(rtc.server, user, password)
-	ccm = CCM(server=(mt_config.ccm.host, mt_config.ccm.db))
-
-	working_project = Project(mt_config.ccm.project, ccm)
-	log.info(pformat(working_project.__dict__))
+class Sessions(object):
+	'''
+	CCM and RTC sessions, and everything else that is expensive to set up,
+	shared by all baselines migrated in a run (in a sync, by all polls).
+	'''
+	def __init__(self, user, password):
+		self.rtc = RTC(host=mt_config.rtc.host, root=mt_config.rtc.root, user=user, password=password)
+		self.cli = CLI(self.rtc.server, user, password)
+		self.cli.start_daemon(mt_config.rtc.sandbox)
+		self.ccm = CCM(server=(mt_config.ccm.host, mt_config.ccm.db))
+
+		# sharded check-in: the migration workspace, plus one per configured shard
+		self.shards, self.pool = None, None
+		if mt_config.rtc.shards:
+			from multiprocessing.pool import ThreadPool
+			self.shards = [Shard(self.cli, mt_config.rtc.workspace, mt_config.rtc.sandbox, mt_config.rtc.ccm_versions)]
+			for workspace, sandbox in shard_settings(mt_config.rtc.shards):
+				shard_cli = CLI(self.rtc.server, user, password)
+				shard_cli.start_daemon(sandbox)
+				self.shards.append(Shard(shard_cli, workspace, sandbox, mt_config.rtc.ccm_versions))
+			self.pool = ThreadPool(len(self.shards))
+			log.info('sharded check-in:\n%s', Lazy(pformat, self.shards))
+
+		self.working_project = Project(mt_config.ccm.project, self.ccm)
+		log.info('%s', Lazy(pformat, self.working_project.__dict__))
+
+		# task membership of baselines is fetched from CCM once, then diffed locally
+		self.index = MembershipIndex(mt_config.ccm.membership_index)
+		self.hash_cache = verify.HashCache(mt_config.migration.hash_cache)
+		from taskindex import TaskIndex
+		self.task_index = TaskIndex(mt_config.migration.task_index)
+	def close(self):
+		if self.pool:
+			self.pool.close()
+		self.task_index.close()
+
+def log_configuration():
+	log.info('configuration for this migration:\n%s\n%s\n%s', Lazy(pformat, mt_config.ccm.__dict__), Lazy(pformat, mt_config.rtc.__dict__),
+			 Lazy(pformat, mt_config.migration.__dict__))
+
+def run_migration(user, password, baseline_advisor):
+	log_configuration()
+	s = Sessions(user, password)
 
 	# find starting baseline
-	baselines = working_project.baselines(purposes=mt_config.ccm.purposes)
+	baselines = s.working_project.baselines(purposes=mt_config.ccm.purposes)
 	try:
 		idx = baselines.index(mt_config.ccm.baseline_initial)
 	except ValueError:
 		raise CCMError("baseline '%s' not found in '%s'" % (mt_config.ccm.baseline_initial, mt_config.ccm.release))
 	baselines = baselines[idx:]
-	log.debug('migrating the following baselines:\n%s' % pformat(baselines))
+	log.debug('migrating the following baselines:\n%s', Lazy(pformat, baselines))
+
+	progress = migrate_baselines(s, baselines, baseline_advisor)
+	progress.completed()
+	s.close()
+	log.info('migration completed')
+
+def sync_migration(user, password, baseline_advisor):
+	'''
+	migrate, then keep following the release: poll CCM every
+	mt_config.migration.sync_interval seconds for baselines created since
+	the newest one in the catalog, and migrate them as they appear.
+	'''
+	log_configuration()
+	s = Sessions(user, password)
+	catalog = BaselineCatalog(mt_config.migration.sync_state, mt_config.ccm.release)
+	if catalog.migrated is None:
+		# first sync: list the whole release once, and start from where an
+		# earlier (batch) migration got to, if any.
+		catalog.add(s.working_project.baseline_records(mt_config.ccm.purposes))
+		status = load_status(mt_config.migration.status_file)
+		start = status['migrated'] if status and status['migrated'] in catalog else mt_config.ccm.baseline_initial
+		if start not in catalog:
+			raise CCMError("baseline '%s' not found in '%s'" % (start, mt_config.ccm.release))
+		catalog.set_migrated(start)
+	aligned = False
+	while True:
+		new = catalog.add(s.working_project.baseline_records(mt_config.ccm.purposes, since=catalog.newest()))
+		if new:
+			log.info('new baselines in "%s":\n%s', mt_config.ccm.release, Lazy(pformat, new))
+		pending = catalog.pending()
+		if pending:
+			progress = migrate_baselines(s, [catalog.migrated] + pending, baseline_advisor,
+										 align=not aligned, migrated=catalog.set_migrated)
+			aligned = True
+			progress.following()
+			log.info('RTC stream "%s" is up to date with "%s"' % (mt_config.rtc.stream, catalog.migrated))
+		log.debug('next poll for new baselines in %d seconds', mt_config.migration.sync_interval)
+		sleep(mt_config.migration.sync_interval)
+
+def migrate_baselines(s, baselines, baseline_advisor, align=True, migrated=None):
+	'''
+	migrate baselines[1:], one after the other, on top of baselines[0],
+	which must have been migrated already; if align is not set, the working
+	project must be at baselines[0] already. migrated (if any) is called
+	with each baseline once it is done. return Progress.
+	'''
+	working_project, cli, rtc, index = s.working_project, s.cli, s.rtc, s.index
+	index.refresh(s.ccm, baselines)
+	progress = Progress(mt_config.migration.status_file, baselines,
+						[len(index.compare(baselines[i-1], baselines[i])[0]) for i in xrange(1, len(baselines))])
+	log.info('%d baselines, %d tasks to migrate, %s' % (progress.remaining() + (progress.eta_text(),)))
 
 	# align working project with initial baseline
-	working_project.baseline_align(baselines[0])
+	if align:
+		working_project.baseline_align(baselines[0])
 
 	log.info('working project "%s" aligned at "%s"' % (mt_config.ccm.project, baselines[0]))
 
@@ -218,38 +567,63 @@ def main():
 
 In BASELINE loop
 ================================================================		
-Migrating from "%s" to "%s"
-
-Press Return to continue (Ctl-C to stop): ''' % (current_bl, next_bl))
-
-		tasks2add, tasks2remove = ccm.baseline_compare(current_bl, next_bl, working_project.name)
-
-		log.info('migrating to baseline "%s"' % next_bl)
-		log.info('adding tasks:\n%s' % pformat(tasks2add))
-
-		# migrate task-by-task
-		add_tasks(ccm_project = working_project,
-				  tasks=tasks2add,
-				  cli=cli,
-				  rtc=rtc,
-				  project_rtc=mt_config.rtc.project,
-				  work_item=mt_config.rtc.work_item,
-				  work_area=mt_config.ccm.work_area)
-
-		# create RTC baseline
-		cli.create_snapshot(remove_dcm_prefix(next_bl), mt_config.rtc.workspace, mt_config.rtc.stream)
-
-		# align work area with next baseline
-		working_project.baseline_align(next_bl)
-
-		# At this point, work_area and sandbox should be nearly
-		# identical, both aligned with next_bl. However, if tasks were
-		# removed from the previously migrated baseline, then it may
-		# be necessary to make the same changes to their associated
-		# objects from the RTC sandbox.
-		align_sandbox(rtc_cli=cli, rtc=rtc, work_item=mt_config.rtc.work_item, baseline=next_bl)
-
-	log.info('migration completed')
+Migrating from "%s" to "%s" (%d baselines, %d tasks to go, %s)
+
+Press Return to continue (Ctl-C to stop): ''' % ((current_bl, next_bl) + progress.remaining() + (progress.eta_text(),)))
+
+		with progress.baseline(next_bl):
+			tasks2add, tasks2remove = index.compare(current_bl, next_bl)
+
+			log.info('migrating to baseline "%s"' % next_bl)
+			log.info('adding tasks:\n%s', Lazy(pformat, tasks2add))
+
+			# migrate task-by-task
+			if s.shards:
+				add_tasks_sharded(ccm_project=working_project,
+								  tasks=tasks2add,
+								  shards=s.shards,
+								  pool=s.pool,
+								  rtc=rtc,
+								  project_rtc=mt_config.rtc.project,
+								  work_item=mt_config.rtc.work_item,
+								  progress=progress,
+								  task_index=s.task_index,
+								  baseline=next_bl)
+			else:
+				add_tasks(ccm_project = working_project,
+						  tasks=tasks2add,
+						  cli=cli,
+						  rtc=rtc,
+						  project_rtc=mt_config.rtc.project,
+						  work_item=mt_config.rtc.work_item,
+						  work_area=mt_config.ccm.work_area,
+						  progress=progress,
+						  task_index=s.task_index,
+						  baseline=next_bl)
+
+			# make sure RTC sandbox has caught up with CCM work area
+			with progress.timed('verify', next_bl):
+				verify_sandbox(next_bl, s.hash_cache)
+
+			# create RTC baseline
+			with progress.timed('snapshot', next_bl):
+				cli.create_snapshot(remove_dcm_prefix(next_bl), mt_config.rtc.workspace, mt_config.rtc.stream)
+			s.task_index.delivered(s.task_index.undelivered(next_bl))
+
+			# align work area with next baseline
+			with progress.timed('alignment', next_bl):
+				working_project.baseline_align(next_bl)
+
+				# At this point, work_area and sandbox should be nearly
+				# identical, both aligned with next_bl. However, if tasks were
+				# removed from the previously migrated baseline, then it may
+				# be necessary to make the same changes to their associated
+				# objects from the RTC sandbox.
+				align_sandbox(rtc_cli=cli, rtc=rtc, work_item=mt_config.rtc.work_item, baseline=next_bl)
+
+		if migrated:
+			migrated(next_bl)
+	return progress
 
 
 if __name__ == "__main__":
@@ -263,5 +637,8 @@ $ python Makespec.py --onefile path/to/ccm2rtc.py
 $ python Build.py ccm2rtc/ccm2rtc.spec
 
 Executable file: ccm2rtc/dist/ccm2rtc
+
+A --onefile executable unpacks itself on every launch; for monitoring
+scripts that run "ccm2rtc status" frequently, build without --onefile.
 '''
 
@@ -0,0 +1,114 @@
+'''
+adaptive concurrency limits protecting the CCM and Jazz servers
+'''
+import threading, time
+import logging
+from contextlib import contextmanager
+
+log = logging.getLogger('limiter')
+
+class Limiter(object):
+	'''
+	AIMD (additive increase, multiplicative decrease) limit on the number
+	of requests in flight to one backend.
+
+	Each successful request raises the limit by 1/limit, i.e. by about one
+	per limit's worth of requests; an error, or a request slower than
+	max_latency (if set), multiplies it by backoff. Decreases are at most
+	one per mean request latency, so a burst of failures from requests
+	that were already in flight counts once.
+	'''
+	def __init__(self, name, initial=4, minimum=1, maximum=16, backoff=0.5, max_latency=None):
+		self.name = name
+		self.limit, self.minimum, self.maximum = float(initial), minimum, maximum
+		self.backoff, self.max_latency = backoff, max_latency
+		self.inflight = 0
+		self.latency = None				# moving average, seconds
+		self.requests = 0
+		self.errors = 0
+		self._decreased = 0
+		self._cond = threading.Condition()
+	def acquire(self):
+		with self._cond:
+			while self.inflight >= int(self.limit):
+				self._cond.wait()
+			self.inflight += 1
+	def release(self, latency, ok):
+		with self._cond:
+			self.inflight -= 1
+			self.requests += 1
+			self.latency = latency if self.latency is None else 0.9 * self.latency + 0.1 * latency
+			congested = not ok or (self.max_latency and latency > self.max_latency)
+			if not congested:
+				self.limit = min(self.maximum, self.limit + 1.0 / self.limit)
+			else:
+				self.errors += not ok
+				now = time.time()
+				if now - self._decreased > self.latency:
+					self.limit = max(self.minimum, self.limit * self.backoff)
+					self._decreased = now
+					log.warning('%s: %s, concurrency limit lowered to %d'
+								% (self.name, 'error' if not ok else 'slow response (%.1fs)' % latency, int(self.limit)))
+			self._cond.notify_all()
+	@contextmanager
+	def slot(self, ignore=()):
+		'''
+		hold one of the allowed in-flight requests, e.g. with limiter.slot(): ...
+
+		exceptions of the types in ignore (e.g. a command failing for reasons
+		of its own) do not count as errors of the backend.
+		'''
+		self.acquire()
+		t0, ok = time.time(), False
+		try:
+			yield
+			ok = True
+		except GeneratorExit:
+			# a generator holding the slot was closed early, not an error
+			ok = True
+			raise
+		except ignore:
+			ok = True
+			raise
+		finally:
+			self.release(time.time() - t0, ok)
+	def snapshot(self):
+		with self._cond:
+			return {'limit':    int(self.limit),
+					'inflight': self.inflight,
+					'latency':  self.latency,
+					'requests': self.requests,
+					'errors':   self.errors}
+
+# backend name ('ccm', 'lscm', 'rest') -> Limiter
+limiters = dict()
+_lock = threading.Lock()
+
+def get(name):
+	with _lock:
+		if name not in limiters:
+			limiters[name] = Limiter(name)
+		return limiters[name]
+
+def configure(settings):
+	'''
+	(re)create limiters from settings, e.g. {'ccm': {'initial': 2, 'maximum': 4}}
+	'''
+	with _lock:
+		for name, kwargs in (settings or {}).items():
+			limiters[name] = Limiter(name, **kwargs)
+
+def limited(name, ignore=()):
+	'decorator: run function in a slot of limiter name (see Limiter.slot)'
+	def deco(f):
+		def f_limited(*args, **kwargs):
+			with get(name).slot(ignore):
+				return f(*args, **kwargs)
+		return f_limited
+	return deco
+
+def snapshot():
+	'return current state of all limiters, e.g. for the status file'
+	with _lock:
+		items = limiters.items()
+	return dict([(name, l.snapshot()) for name, l in items])
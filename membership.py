@@ -0,0 +1,103 @@
+'''
+release-wide index of baseline task membership
+'''
+import os, os.path, cPickle
+import logging
+
+log = logging.getLogger('membership')
+
+class MembershipIndex(object):
+	'''
+	Task membership of the baselines in a release.
+
+	Task ids (e.g. 'cup=25637') are interned to integers, which are used as
+	bit positions; each baseline's membership is stored as a bitmap (a
+	python long). Diffing any two baselines is then a pair of bitwise
+	operations, independent of how the baselines were fetched.
+
+	Baselines are immutable, so their membership is fetched from CCM only
+	once, and the index is persisted to path (if any) as it grows.
+	'''
+	version = 1
+	def __init__(self, path=None):
+		self.path = path
+		self.tasks = list()				# bit position -> task id
+		self.baselines = list()			# baselines, in the order they were added
+		self._bits = dict()				# task id -> bit position
+		self._members = dict()			# baseline -> bitmap
+		if path and os.path.isfile(path):
+			self.load()
+	def load(self):
+		f = open(self.path, 'rb')
+		try:
+			state = cPickle.load(f)
+		finally:
+			f.close()
+		if state.get('version') != self.version:
+			log.warning('ignoring membership index "%s" (version %s, expected %s)'
+						% (self.path, state.get('version'), self.version))
+			return
+		self.tasks, self.baselines, self._members = state['tasks'], state['baselines'], state['members']
+		self._bits = dict([(t, i) for i, t in enumerate(self.tasks)])
+		log.info('loaded membership index "%s": %d baselines, %d tasks'
+				 % (self.path, len(self.baselines), len(self.tasks)))
+	def save(self):
+		if not self.path:
+			return
+		state = {'version':   self.version,
+				 'tasks':     self.tasks,
+				 'baselines': self.baselines,
+				 'members':   self._members}
+		tmp = '%s.tmp' % self.path
+		f = open(tmp, 'wb')
+		try:
+			cPickle.dump(state, f, cPickle.HIGHEST_PROTOCOL)
+		finally:
+			f.close()
+		os.rename(tmp, self.path)
+	def __contains__(self, baseline):
+		return baseline in self._members
+	def intern(self, task):
+		'return bit position of task, allocating one if necessary'
+		try:
+			return self._bits[task]
+		except KeyError:
+			self._bits[task] = len(self.tasks)
+			self.tasks.append(task)
+			return self._bits[task]
+	def add(self, baseline, tasks):
+		'record task membership of baseline'
+		bitmap = 0L
+		for t in tasks:
+			bitmap |= 1L << self.intern(t)
+		if baseline not in self._members:
+			self.baselines.append(baseline)
+		self._members[baseline] = bitmap
+	def decode(self, bitmap):
+		'return set of task ids in bitmap'
+		bits = bin(bitmap)[:1:-1]
+		tasks = set()
+		i = bits.find('1')
+		while i >= 0:
+			tasks.add(self.tasks[i])
+			i = bits.find('1', i + 1)
+		return tasks
+	def members(self, baseline):
+		return self.decode(self._members[baseline])
+	def compare(self, bl1, bl2):
+		'''
+		same as CCM.baseline_compare, for baselines already in the index:
+		return (a, r) where, in order to get a working project at bl1 to bl2,
+		  a is the set of tasks to be added (in bl2, but not in bl1)
+		  r is the set of tasks to be removed (in bl1, but not in bl2)
+		'''
+		m1, m2 = self._members[bl1], self._members[bl2]
+		return (self.decode(m2 & ~m1), self.decode(m1 & ~m2))
+	def refresh(self, ccm, baselines):
+		'fetch membership of baselines not yet in the index, saving after each one'
+		for bl in baselines:
+			if bl in self._members:
+				continue
+			log.info('fetching task membership of baseline "%s"' % bl)
+			self.add(bl, ccm.project_tasks(ccm.baseline_project(bl, None)))
+			self.save()
@@ -0,0 +1,160 @@
+'''
+migration configuration: declaration, loading and validation
+
+A configuration file is a list of assignments of literal values, e.g.
+
+  mt_config.ccm.host = 'spvtgccm5'
+
+(see mt_config for a complete example). It is parsed, not executed, and
+checked against the declarations in schema below.
+'''
+import ast, inspect, logging
+import limiter
+
+class ConfigError(Exception):
+	pass
+
+class mt_config:
+	'container for configuration elements, specified externally'
+	class ccm:
+		pass
+	class rtc:
+		pass
+	class migration:
+		pass
+
+REQUIRED = object()
+
+# section -> [(name, type, default)]; REQUIRED elements have no default.
+schema = {
+	'ccm': [('host',               str,  REQUIRED),
+			('db',                 str,  REQUIRED),
+			('project',            str,  REQUIRED),
+			('work_area',          str,  REQUIRED),
+			('baseline_initial',   str,  REQUIRED),
+			('release',            str,  REQUIRED),
+			('purposes',           list, REQUIRED),
+			('membership_index',   str,  None)],
+	'rtc': [('host',               str,  REQUIRED),
+			('root',               str,  REQUIRED),
+			('project',            str,  REQUIRED),
+			('stream',             str,  REQUIRED),
+			('workspace',          str,  REQUIRED),
+			('sandbox',            str,  REQUIRED),
+			('work_item',          str,  REQUIRED),
+			('ccm_versions',       str,  REQUIRED),
+			('shards',             list, None)],
+	'migration': [('status_file',    str,  None),
+				  ('log_level',      str,  'INFO'),
+				  ('log_levels',     dict, None),
+				  ('log_cap',        int,  None),
+				  ('log_spill_dir',  str,  None),
+				  ('limits',         dict, None),
+				  ('verify',         str,  'warn'),
+				  ('hash_cache',     str,  None),
+				  ('sync_state',     str,  None),
+				  ('sync_interval',  int,  300),
+				  ('task_index',     str,  None)],
+}
+
+def _level(value):
+	if not isinstance(logging.getLevelName(value), int):
+		return 'must be a logging level, e.g. \'DEBUG\', \'INFO\' or \'WARNING\''
+
+def _levels(value):
+	for name, level in sorted(value.items()):
+		if _level(level):
+			return 'has invalid level %r for "%s" (%s)' % (level, name, _level(level))
+
+def _verify(value):
+	if value not in ('off', 'warn', 'fail'):
+		return 'must be \'off\', \'warn\' or \'fail\''
+
+def _limits(value):
+	backends, settings = ('ccm', 'lscm', 'rest'), inspect.getargspec(limiter.Limiter.__init__).args[2:]
+	for name, kwargs in sorted(value.items()):
+		if name not in backends:
+			return 'has unknown backend "%s" (not one of %s)' % (name, ', '.join(backends))
+		if not isinstance(kwargs, dict):
+			return 'must map each backend to a dict of settings'
+		for k, v in sorted(kwargs.items()):
+			if k not in settings:
+				return 'has unknown setting "%s" for "%s" (not one of %s)' % (k, name, ', '.join(settings))
+			if not isinstance(v, (int, float)):
+				return 'has non-numeric setting "%s" for "%s"' % (k, name)
+
+def _shards(value):
+	for s in value:
+		if not (isinstance(s, dict) and sorted(s) == ['sandbox', 'workspace']
+				and all([isinstance(v, basestring) for v in s.values()])):
+			return 'must be a list of {\'workspace\': ..., \'sandbox\': ...}, not containing %r' % (s,)
+
+# (section, name) -> function returning a problem with a value of the
+# right type, or None if there is none
+checks = {('rtc', 'shards'):          _shards,
+		  ('migration', 'log_level'):  _level,
+		  ('migration', 'log_levels'): _levels,
+		  ('migration', 'limits'):     _limits,
+		  ('migration', 'verify'):     _verify}
+
+def parse_config(path):
+	'''
+	parse configuration file, return ({(section, name): value}, [problem, ...])
+	'''
+	values, problems = dict(), list()
+	f = open(path)
+	try:
+		src = f.read()
+	finally:
+		f.close()
+	try:
+		tree = ast.parse(src, path)
+	except SyntaxError, e:
+		return values, ['%s:%s: %s' % (path, e.lineno, e.msg)]
+	declared = dict([(s, dict([(e[0], e) for e in elements])) for s, elements in schema.items()])
+	for stmt in tree.body:
+		where = '%s:%s' % (path, stmt.lineno)
+		t = stmt.targets[0] if isinstance(stmt, ast.Assign) and len(stmt.targets) == 1 else None
+		if not (isinstance(t, ast.Attribute)
+				and isinstance(t.value, ast.Attribute)
+				and isinstance(t.value.value, ast.Name)
+				and t.value.value.id == 'mt_config'):
+			problems.append('%s: not an assignment to mt_config.<section>.<name>' % where)
+			continue
+		section, name = t.value.attr, t.attr
+		if name not in declared.get(section, {}):
+			problems.append('%s: unknown configuration element "mt_config.%s.%s"' % (where, section, name))
+			continue
+		try:
+			value = ast.literal_eval(stmt.value)
+		except ValueError:
+			problems.append('%s: value of "mt_config.%s.%s" is not a literal' % (where, section, name))
+			continue
+		etype = declared[section][name][1]
+		if not (etype is str and isinstance(value, basestring) or isinstance(value, etype)):
+			problems.append('%s: "mt_config.%s.%s" must be a %s' % (where, section, name, etype.__name__))
+			continue
+		problem = checks[(section, name)](value) if (section, name) in checks else None
+		if problem:
+			problems.append('%s: "mt_config.%s.%s" %s' % (where, section, name, problem))
+			continue
+		values[(section, name)] = value
+	for section, elements in sorted(schema.items()):
+		for name, etype, default in elements:
+			if default is REQUIRED and (section, name) not in values:
+				problems.append('%s: "mt_config.%s.%s" is required' % (path, section, name))
+	return values, problems
+
+def check_config(path):
+	'return list of problems in configuration file (empty if none)'
+	return parse_config(path)[1]
+
+def load_config(path):
+	'load configuration file into mt_config, raise ConfigError if it is invalid'
+	values, problems = parse_config(path)
+	if problems:
+		raise ConfigError('invalid configuration:\n%s' % '\n'.join(problems))
+	for section, elements in schema.items():
+		for name, etype, default in elements:
+			setattr(getattr(mt_config, section), name, values.get((section, name), default))
+	return mt_config
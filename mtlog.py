@@ -0,0 +1,84 @@
+'''
+logging setup for migration runs
+
+- each module logs to its own logger ('ccm', 'rtc', 'ccm2rtc', ...), whose
+  level can be set separately.
+- messages are formatted only if they are emitted: pass arguments to the
+  logger instead of %-formatting them, and wrap expensive ones in Lazy,
+  e.g. log.debug('objects:\n%s', Lazy(pformat, objects)).
+- emitted messages longer than cap are truncated; the full text goes to
+  a rotating, gzip-compressed spill file, referenced from the log.
+'''
+import gzip, os, os.path, threading, time
+import logging
+
+class Lazy(object):
+	'defer f(*args) until the log message is actually formatted'
+	def __init__(self, f, *args):
+		self.f, self.args = f, args
+	def __str__(self):
+		return str(self.f(*self.args))
+
+class Spill(object):
+	'''
+	rotating gzip-compressed files for oversized log messages:
+	<dir>/spill.log.gz, and at most backups older ones (spill.log.1.gz, ...)
+
+	each message is a separate gzip member, so the current file can be read
+	(e.g. with zcat) while the migration is still writing to it.
+	'''
+	def __init__(self, dir, max_bytes=64*1024*1024, backups=5):
+		self.dir, self.max_bytes, self.backups = dir, max_bytes, backups
+		self.path = os.path.join(dir, 'spill.log.gz')
+		os.path.isdir(dir) or os.makedirs(dir)
+		self._lock = threading.Lock()
+		self._n = 0
+	def _rotate(self):
+		for i in xrange(self.backups - 1, 0, -1):
+			src = os.path.join(self.dir, 'spill.log.%d.gz' % i)
+			if os.path.exists(src):
+				os.rename(src, os.path.join(self.dir, 'spill.log.%d.gz' % (i + 1)))
+		if self.backups:
+			os.rename(self.path, os.path.join(self.dir, 'spill.log.1.gz'))
+		else:
+			os.remove(self.path)
+	def write(self, record, text):
+		'save text of record, return reference to it'
+		with self._lock:
+			if os.path.exists(self.path) and os.path.getsize(self.path) >= self.max_bytes:
+				self._rotate()
+			self._n += 1
+			f = gzip.open(self.path, 'ab')
+			try:
+				f.write('=== #%d %s %s %s\n%s\n' % (self._n, time.strftime('%Y-%m-%d %H:%M:%S', time.localtime(record.created)),
+												  record.name, record.levelname, text))
+			finally:
+				f.close()
+			return '%s #%d' % (self.path, self._n)
+
+class CapFilter(logging.Filter):
+	'truncate messages longer than cap, spilling full text to spill (if any)'
+	def __init__(self, cap, spill=None):
+		logging.Filter.__init__(self)
+		self.cap, self.spill = cap, spill
+	def filter(self, record):
+		msg = record.getMessage()
+		if len(msg) > self.cap:
+			where = self.spill.write(record, msg) if self.spill else 'not saved'
+			msg = '%s [... %d bytes truncated, full text: %s]' % (msg[:self.cap], len(msg) - self.cap, where)
+		# format once; handlers would otherwise format again
+		record.msg, record.args = msg, ()
+		return True
+
+def configure(level='INFO', levels=None, cap=None, spill_dir=None):
+	'''
+	configure root logger at level, with per-logger levels (e.g.
+	{'ccm': 'DEBUG'}) and, if cap is set, truncation of long messages.
+	'''
+	logging.basicConfig(level=getattr(logging, level), format='%(asctime)s %(name)s %(message)s')
+	for name, l in (levels or {}).items():
+		logging.getLogger(name).setLevel(getattr(logging, l))
+	if cap:
+		f = CapFilter(cap, Spill(spill_dir) if spill_dir else None)
+		for h in logging.getLogger().handlers:
+			h.addFilter(f)
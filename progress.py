@@ -0,0 +1,158 @@
+'''
+migration progress, timing history and ETA
+'''
+import json, os, os.path, threading, time
+import logging
+from contextlib import contextmanager
+import limiter
+
+log = logging.getLogger('progress')
+
+def load_status(path):
+	'return migration status saved in path, or None'
+	if not (path and os.path.isfile(path)):
+		return None
+	f = open(path)
+	try:
+		return json.load(f)
+	finally:
+		f.close()
+
+def save_status(path, status):
+	'save migration status in path (if any), atomically'
+	if not path:
+		return
+	status['updated'] = time.time()
+	tmp = '%s.tmp' % path
+	f = open(tmp, 'w')
+	try:
+		json.dump(status, f, indent=1)
+	finally:
+		f.close()
+	os.rename(tmp, path)
+
+def plan(status):
+	'return baselines that are yet to be migrated'
+	bls = status['baselines']
+	return bls[bls.index(status['migrated']) + 1:] if status['migrated'] in bls else bls
+
+class Progress(object):
+	'''
+	Tracks how far a migration is, and how long it will take.
+
+	Durations are recorded per baseline, per task, and per stage of a
+	task ('update', 'checkin', ...). Their running means, which are kept
+	in the status file and therefore survive restarts, give the ETA:
+
+	  remaining tasks * mean task time + remaining baselines * mean baseline overhead
+
+	where baseline overhead is the time a baseline takes beyond its tasks
+	(snapshot, alignment, ...). Anything taking more than slow_factor times
+	its mean is reported as slow, in the log and in the status file.
+
+	Stages may be recorded from several threads (see add_tasks_sharded).
+	'''
+	slow_factor = 3.0
+	min_samples = 5					# samples needed before anything is called slow
+	max_slow = 50					# slow entries kept in status file
+	def __init__(self, path, baselines, tasks):
+		'''
+		baselines is the list of baselines, starting with the one already
+		migrated; tasks[i] is the number of tasks to be added to get from
+		baselines[i] to baselines[i+1].
+		'''
+		self.path = path
+		self._lock = threading.Lock()
+		previous = load_status(path) or {}
+		self.status = {'state':     'running',
+					   'pid':       os.getpid(),
+					   'started':   time.time(),
+					   'baselines': baselines,
+					   'tasks':     tasks,
+					   'migrated':  baselines[0],
+					   'current':   None,
+					   'stats':     previous.get('stats', {}),
+					   'slow':      previous.get('slow', [])}
+		self._tasks_done = 0
+		self._task_seconds = 0.0
+		self.save()
+	def save(self):
+		with self._lock:
+			self.status['remaining'] = self.remaining()
+			self.status['eta'] = self.eta()
+			self.status['limits'] = limiter.snapshot()
+			save_status(self.path, self.status)
+	def remaining(self):
+		'return (baselines, tasks) remaining'
+		bls = self.status['baselines']
+		i = bls.index(self.status['migrated'])
+		return (len(bls) - i - 1, max(0, sum(self.status['tasks'][i:]) - self._tasks_done))
+	def mean(self, kind):
+		s = self.status['stats'].get(kind)
+		return s['total'] / s['n'] if s and s['n'] else None
+	def eta(self):
+		'return estimated seconds to completion, or None if there is no history yet'
+		bls, tasks = self.remaining()
+		task_mean, bl_mean = self.mean('task'), self.mean('baseline overhead')
+		if (tasks and task_mean is None) or (bls and bl_mean is None):
+			return None
+		return tasks * (task_mean or 0) + bls * (bl_mean or 0)
+	def eta_text(self):
+		eta = self.eta()
+		if eta is None:
+			return 'ETA unknown'
+		return 'ETA %s (%.1f hours)' % (time.ctime(time.time() + eta), eta / 3600)
+	def record(self, kind, name, seconds):
+		'add duration to history of kind, report it if it is abnormally slow'
+		with self._lock:
+			mean = self.mean(kind)
+			s = self.status['stats'].setdefault(kind, {'n': 0, 'total': 0.0})
+			if mean is not None and s['n'] >= self.min_samples and seconds > self.slow_factor * mean:
+				log.warning('slow %s "%s": %.1f seconds (mean: %.1f seconds)' % (kind, name, seconds, mean))
+				self.status['slow'] = (self.status['slow'] + [{'kind':    kind,
+															   'name':    name,
+															   'seconds': seconds,
+															   'mean':    mean,
+															   'time':    time.time()}])[-self.max_slow:]
+			s['n'] += 1
+			s['total'] += seconds
+	@contextmanager
+	def timed(self, kind, name):
+		t0 = time.time()
+		yield
+		self.record(kind, name, time.time() - t0)
+	def stage(self, task, stage):
+		'time stage of task, e.g. with progress.stage(task, "checkin"): ...'
+		return self.timed('stage %s' % stage, task)
+	@contextmanager
+	def task(self, task):
+		t0 = time.time()
+		yield
+		self.task_done(task, time.time() - t0)
+	def task_done(self, task, seconds):
+		'record that task is done, having taken seconds'
+		self.record('task', task, seconds)
+		self._tasks_done += 1
+		self._task_seconds += seconds
+		self.save()
+	@contextmanager
+	def baseline(self, baseline):
+		'time migration of baseline (from the previously migrated one)'
+		self.status['current'] = baseline
+		self.save()
+		t0 = time.time()
+		self._tasks_done, self._task_seconds = 0, 0.0
+		yield
+		seconds = time.time() - t0
+		self.record('baseline', baseline, seconds)
+		self.record('baseline overhead', baseline, seconds - self._task_seconds)
+		self.status['migrated'], self.status['current'] = baseline, None
+		self._tasks_done, self._task_seconds = 0, 0.0
+		self.save()
+	def completed(self):
+		self.status['state'] = 'completed'
+		self.save()
+	def following(self):
+		'all baselines so far are migrated, waiting for new ones (see sync_migration)'
+		self.status['state'] = 'following'
+		self.save()
@@ -1,12 +1,15 @@
 '''
 Rational Team Concert
 '''
-import json, os, os.path, pycurl, re, StringIO, subprocess, sys, time, urllib
+import json, os, os.path, pycurl, re, StringIO, subprocess, sys, tempfile, threading, time, urllib
 import pdb
-import logging as log
+import logging
 import xml.dom.minidom as minidom
 from pprint import *
 from retry import retry
+from limiter import limited
+
+log = logging.getLogger('rtc')
 
 class FileReader:
 	'Helper class to supply libcurl read function callbacks'
@@ -19,6 +22,75 @@ class FileReader:
 class RTCError(Exception):
 	pass
 
+class AuthenticationRequired(RTCError):
+	'HTTP 302: the server wants us to log in (again)'
+	pass
+
+class ChangeSetNotFound(RTCError):
+	'no change set id in the output of a successful lscm checkin'
+	pass
+
+class ResponseTooLarge(Exception):
+	'response body exceeds limit; not an RTCError, so it is not retried'
+	pass
+
+class ServerError(Exception):
+	'''
+	HTTP 5xx response to a request that is not idempotent (e.g. creating a
+	work item); not an RTCError, so it is not retried: the server may have
+	carried it out, and repeating it could create a duplicate
+	'''
+	pass
+
+class Response(object):
+	'''
+	Response to a single do_curl request.
+
+	The body is collected as a list of chunks, joined once when first
+	used; headers are parsed as they arrive. When curl follows redirects,
+	only the final response's status, headers and body are kept.
+	'''
+	def __init__(self, max_body=None):
+		self.max_body = max_body
+		self.status = None
+		self.headers = dict()			# lower-case header name -> value
+		self.size = 0
+		self.too_large = False
+		self._header_lines = list()
+		self._chunks = list()
+		self._body = None
+		self._json = None
+	def header_callback(self, buf):
+		line = buf.rstrip('\r\n')
+		if line.startswith('HTTP/'):
+			# status line of a new response (redirect, 100 Continue): start over
+			self.status = int(line.split()[1])
+			self.headers, self._header_lines, self._chunks, self.size = dict(), list(), list(), 0
+		elif ':' in line:
+			name, value = line.split(':', 1)
+			self.headers[name.strip().lower()] = value.strip()
+		self._header_lines.append(buf)
+	def write_callback(self, buf):
+		self.size += len(buf)
+		if self.max_body and self.size > self.max_body:
+			self.too_large = True
+			return 0					# anything but len(buf) aborts the transfer
+		self._chunks.append(buf)
+	@property
+	def header_text(self):
+		return ''.join(self._header_lines)
+	@property
+	def body(self):
+		if self._body is None:
+			self._body = ''.join(self._chunks)
+			self._chunks = [self._body]
+		return self._body
+	def json(self):
+		'return body decoded as JSON (decoded once)'
+		if self._json is None:
+			self._json = json.loads(self.body)
+		return self._json
+
 class Server(object):
 	'''
 	Jazz Team Server hostname, port, and RTC(?) version.
@@ -33,21 +105,123 @@ class Server(object):
 		self.url = 'https://%s:%s/%s' % (self.host, self.port, root)
 
 class CLI(object):
+	'''
+	lscm command line interface.
+
+	lscm commands are served by a daemon; start_daemon() starts it (and
+	logs in) once per run, and execute() periodically checks that it is
+	still there, restarting it if necessary.
+	'''
+	daemon_check_interval = 300			# seconds between daemon health checks
+	password_file_option = '--passwordFile'	# keeps the password off the command line (and out of ps)
 	def __init__(self, server, user, password, scm='lscm'):
 		self.server = server
 		self.user = user
 		self.password = password
 		self.scm = scm
-	@retry(RTCError, tries=9, delay=8, backoff=2, logger=log)
-	def execute(self, cmd, scm_opts=''):
+		self.sandbox = None
+		self._daemon_checked = 0
+	@limited('lscm')
+	def _run(self, cmd, scm_opts='', display=None, cwd=None):
+		'''
+		run lscm command once (in directory cwd, default: current working
+		directory), return standard output; display (if any) is logged
+		instead of cmd
+		'''
 		cl = '%s %s %s' % (self.scm, scm_opts, cmd)
-		log.info('starting RTC CLI command: %s' % cl)
-		p = subprocess.Popen(cl, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE)
+		log.info('starting RTC CLI command: %s', '%s %s %s' % (self.scm, scm_opts, display) if display else cl)
+		p = subprocess.Popen(cl, shell=True, stdout=subprocess.PIPE, stderr=subprocess.PIPE, cwd=cwd)
 		o, e = p.communicate()
 		if p.returncode != 0:
-			raise RTCError('failed to execute RTC CLI command "%s" (status: %s):\n%s' % (cmd, p.returncode, e))
+			raise RTCError('failed to execute RTC CLI command "%s" (status: %s):\n%s'
+						   % (display or cmd, p.returncode, e))
 		log.info('back from RTC CLI command.')
 		return o
+	@retry(RTCError, tries=9, delay=8, backoff=2, logger=log)
+	def execute(self, cmd, scm_opts='', json_out=False, cwd=None):
+		'''
+		execute lscm command in directory cwd (default: current working
+		directory); if json_out is set, request machine-readable output and
+		return it decoded.
+		'''
+		self.check_daemon()
+		if not json_out:
+			return self._run(cmd, scm_opts, cwd=cwd)
+		o = self._run('%s --json' % cmd, scm_opts, cwd=cwd)
+		try:
+			return json.loads(o)
+		except ValueError:
+			raise RTCError('invalid JSON output from RTC CLI command "%s":\n%s' % (cmd, o))
+	def start_daemon(self, sandbox):
+		'start lscm daemon for sandbox (unless one is running) and log in'
+		self.sandbox = sandbox
+		if not self.daemon_alive():
+			log.info('starting lscm daemon for "%s"' % sandbox)
+			self._run('daemon start "%s"' % sandbox)
+		pw = tempfile.NamedTemporaryFile()	# readable by this user only
+		try:
+			pw.write(self.password)
+			pw.flush()
+			self._run('login -r "%s" -u "%s" %s "%s"' % (self.server.url, self.user, self.password_file_option, pw.name),
+					  display='login -r "%s" -u "%s"' % (self.server.url, self.user))
+		finally:
+			pw.close()
+		self._daemon_checked = time.time()
+	def stop_daemon(self):
+		if self.sandbox:
+			self._run('daemon stop "%s"' % self.sandbox)
+			self.sandbox = None
+	def daemon_alive(self):
+		try:
+			return self.sandbox in self._run('list daemons')
+		except RTCError, e:
+			log.warning('unable to list lscm daemons: %s' % e)
+			return False
+	def check_daemon(self):
+		'restart lscm daemon if it has not been checked recently and is gone'
+		if not self.sandbox or (time.time() - self._daemon_checked) < self.daemon_check_interval:
+			return
+		self._daemon_checked = time.time()
+		if not self.daemon_alive():
+			log.warning('lscm daemon for "%s" is gone, restarting' % self.sandbox)
+			self.start_daemon(self.sandbox)
+	@staticmethod
+	def _objects(data):
+		'yield every JSON object (dict) in decoded JSON data'
+		if isinstance(data, dict):
+			yield data
+			data = data.values()
+		if isinstance(data, list):
+			for v in data:
+				for d in CLI._objects(v):
+					yield d
+	def unresolved(self, cwd=None):
+		'return True if the sandbox (cwd, default: current working directory) has changes to check in'
+		for d in self._objects(self.execute('status -w', json_out=True, cwd=cwd)):
+			if d.get('unresolved'):
+				return True
+		return False
+	def checkin(self, path='.', cwd=None):
+		'check in path (relative to cwd), return id of resulting change set'
+		r = self.execute('checkin --delim-none "%s"' % path, scm_opts='-a n -u y', json_out=True, cwd=cwd)
+		log.debug('%s', r)
+		# lscm versions differ in how they nest their JSON output, so look for
+		# a change set (an object with a uuid and a list of changes) anywhere.
+		for d in self._objects(r):
+			if 'uuid' in d and 'changes' in d:
+				return d['uuid']
+		raise ChangeSetNotFound('unable to find changeset id in: \n%s' % pformat(r))
+	def annotate(self, csid, comment, work_items, cwd=None):
+		'set change set comment and associate work items with it'
+		log.info('%s', self.execute('changeset comment "%s" "%s"' % (csid, comment), cwd=cwd))
+		for wi in work_items:
+			log.info('%s', self.execute('changeset associate "%s" "%s"' % (csid, wi), cwd=cwd))
+	def deliver(self, cwd=None):
+		'deliver outgoing change sets of the sandbox (cwd) to its flow target'
+		log.info('%s', self.execute('deliver', cwd=cwd))
+	def accept(self, cwd=None):
+		'accept incoming change sets from the flow target into the sandbox (cwd)'
+		log.info('%s', self.execute('accept', cwd=cwd))
 	def compare_baselines(self, component, b1, b2):
 		return self.execute('compare -r "%s" --component "%s" baseline "%s" baseline "%s"'
 							% (self.server.url, component, b1, b2), scm_opts='-a n -u y')
@@ -55,30 +229,19 @@ class CLI(object):
 		return self.execute('compare -r "%s" --component "%s" baseline "%s" stream "%s"'
 							% (self.server.url, component, b1, s1), scm_opts='-a n -u y')
 	def migrate_baseline(self, baseline, work_item):
-		txt = self.execute('checkin --delim-none .', scm_opts='-a n -u y')
-		log.debug(txt)
-		m = re.compile(r'(?m)Change sets:\W*\(([-_A-Za-z0-9]+)\)').search(txt)
-		if m:
-			csid = m.group(1)
-		else:
-			raise RTCError('unable to find changeset id in: \n%s' % txt)
-
-		# set changeset comment to CCM task id.
-		log.info(self.execute('changeset comment "%s" "migrating baseline \'%s\'"' % (csid, baseline)))
-
-		# associate changeset to common work item.
-		log.info(self.execute('changeset associate "%s" "%s"' % (csid, work_item)))
+		csid = self.checkin()
+		self.annotate(csid, "migrating baseline '%s'" % baseline, [work_item])
 	def create_snapshot(self, baseline, workspace, stream):
 		'create snapshot from sandbox (current working directory)'
 		log.info('creating RTC snapshot "%s"' % baseline)
 
 		ss_txt = self.execute("create snapshot -n '%s' '%s'" % (baseline, workspace), scm_opts='-a n -u y')
-		log.debug(ss_txt)
+		log.debug('%s', ss_txt)
 		m = re.compile(r'(?ms)Snapshot \(([-_A-Za-z0-9]+)\) .* successfully created').search(ss_txt)
 		if m:
 			ssid = m.group(1)
-			log.info(self.execute("deliver"))
-			log.info(self.execute("snapshot promote '%s' '%s'" % (stream, ssid)))
+			self.deliver()
+			log.info('%s', self.execute("snapshot promote '%s' '%s'" % (stream, ssid)))
 		else:
 			raise RTCError('unable to create snapshot "%s" in workspace "%s"' % (baseline, workspace))
 
@@ -88,13 +251,17 @@ class RTC(object):
 	'''
 	path_auth_id = 'jts/authenticated/identity'
 	path_auth_check = 'jts/authenticated/j_security_check'
+	max_response = 64 * 1024 * 1024	# largest response body accepted by do_curl
 	def __init__(self, host = None, root='ccm', user=None, password=None):
 		self.server = Server(host=host, root=root)
 		self.authenticated = False
 		self.user = user
 		self.password = password
-		self._last_response = ''
 		self._auth_timeout = 3600		# reauthenticate every hour (3600 seconds)
+		# work items may be created from several threads. Lock order: _auth_lock,
+		# then 'rest' limiter slots (taken by requests made while authenticating),
+		# never the other way around; see do_curl.
+		self._auth_lock = threading.RLock()
 		tmpdir = os.getenv('TMPDIR')
 		tmpdir = tmpdir if (tmpdir and os.path.isdir(tmpdir)) else '/tmp'
 		self.cookie_file = ('%s/cookie.%s' % (tmpdir, self.server.host))
@@ -103,28 +270,38 @@ class RTC(object):
 			os.remove(self.cookie_file)
 		except OSError:
 			pass
-	def reauthenticate(self):
-		self.authenticated = False
-		self.authenticate()
-	def authenticate(self):
-		if self.authenticated:
-			if (time.time() - self._authtime) > self._auth_timeout:
-				# time to reauthenticate
-				log.info('60 minutes since last authentication, reauthenticating now')
-				self.authenticated = False
-			else:
-				# existing authentication should still be valid
+	def reauthenticate(self, since=None):
+		'''
+		authenticate again, unless another thread did so after since (e.g.
+		the start of a request turned away for lack of authentication)
+		'''
+		with self._auth_lock:
+			if since is not None and self.authenticated and self._authtime > since:
 				return
-		log.info("Authenticating for REST...")
-		self.remove_cookie_file()
-		try:
-			self.create_session_id()
-			self.check_auth()
-		except:
-			raise RTCError('unable to authenticate')
-		self.authenticated = True
-		self._authtime = time.time()
-		log.info("Authenticated for REST.")
+			self.authenticated = False
+			self.authenticate()
+	def authenticate(self):
+		if self.authenticated and (time.time() - self._authtime) <= self._auth_timeout:
+			return
+		with self._auth_lock:
+			if self.authenticated:
+				if (time.time() - self._authtime) > self._auth_timeout:
+					# time to reauthenticate
+					log.info('60 minutes since last authentication, reauthenticating now')
+					self.authenticated = False
+				else:
+					# existing authentication should still be valid
+					return
+			log.info("Authenticating for REST...")
+			self.remove_cookie_file()
+			try:
+				self.create_session_id()
+				self.check_auth()
+			except:
+				raise RTCError('unable to authenticate')
+			self.authenticated = True
+			self._authtime = time.time()
+			log.info("Authenticated for REST.")
 	def create_session_id(self):
 		opts = {pycurl.COOKIEJAR:      self.cookie_file}
 		self.do_curl(opts, '%s/%s' % (self.server.url, self.path_auth_id))
@@ -133,67 +310,89 @@ class RTC(object):
 					  ('j_password', self.password),]
 		opts = {pycurl.POSTFIELDS:     urllib.urlencode(postfields),
 				pycurl.COOKIEJAR:      self.cookie_file}
-		response = self.do_curl(opts, '%s/%s' % (self.server.url, self.path_auth_check))
+		response = self.do_curl(opts, '%s/%s' % (self.server.url, self.path_auth_check)).body
 		if (('authrequired' in response)
 			or
 			('authfailed' in response)):
 			raise RTCError('Unable to authenticate "%s"' % self.user)
 	@retry(RTCError, tries=9, delay=8, backoff=2, logger=log)
-	def do_curl(self, options, url):
-		def header(buf):
-			self._body_offset += len(buf)
-		def capture(buf):
-			self._last_response += buf
-		self._body_offset = 0
-		self._last_response = ''
+	def do_curl(self, options, url, max_body=None, data=None, idempotent=True):
+		'''
+		perform request, return Response; bodies larger than max_body
+		(default: self.max_response) raise ResponseTooLarge.
+
+		data (if any) is sent as request body, afresh on each attempt.
+		Server errors (HTTP 5xx) are retried only if the request is
+		idempotent; otherwise they raise ServerError.
+		'''
+		t0 = time.time()
+		try:
+			return self._curl(options, url, max_body, data, idempotent)
+		except AuthenticationRequired:
+			# reauthenticate only now, outside the 'rest' slot _curl held:
+			# authenticating takes slots of its own, and with the limit down
+			# to one, waiting for them while holding one would never end.
+			log.info('do_curl received HTTP response code 302, reauthenticating...')
+			self.reauthenticate(since=t0)
+			raise
+	@limited('rest', ignore=(AuthenticationRequired, ResponseTooLarge))
+	def _curl(self, options, url, max_body, data, idempotent):
+		'perform request once, in a slot of the rest limiter (see do_curl)'
+		response = Response(max_body or self.max_response)
 		all_opts = {pycurl.URL:            str(url),
 					pycurl.VERBOSE:        0,
 					pycurl.SSL_VERIFYHOST: 0,
 					pycurl.SSL_VERIFYPEER: 0,
 					pycurl.FOLLOWLOCATION: 1,
 					pycurl.COOKIEFILE:     self.cookie_file,
-					pycurl.WRITEFUNCTION:  capture,
-					pycurl.HEADERFUNCTION: header}
+					pycurl.WRITEFUNCTION:  response.write_callback,
+					pycurl.HEADERFUNCTION: response.header_callback}
 		if options:
 			all_opts.update(options)
+		if data is not None:
+			all_opts[pycurl.READFUNCTION] = FileReader(StringIO.StringIO(data)).read_callback
 		curl = pycurl.Curl()
 		for k, v in all_opts.items():
 			curl.setopt(k, v)
 		try:
 			curl.perform()
-			log.info(curl.getinfo(curl.EFFECTIVE_URL))
+			log.debug('%s', curl.getinfo(curl.EFFECTIVE_URL))
+			rcode = curl.getinfo(pycurl.RESPONSE_CODE)
+			if int(rcode) >= 500:
+				# server overloaded or failing; let retry logic (and the limiter) back off
+				if not idempotent:
+					raise ServerError('RTC server error (RTC response code: %s), not retried' % rcode)
+				raise RTCError('RTC server error (RTC response code: %s)' % rcode)
 		except pycurl.error, v:
+			if response.too_large:
+				raise ResponseTooLarge('response from "%s" exceeds %d bytes' % (url, response.max_body))
 			rcode = curl.getinfo(pycurl.RESPONSE_CODE)
 			if int(rcode) == 302:
 				'''According to https://jazz.net/library/article/194, HTTP response code 302 means
 				   we have an authentication failure and server is redirecting us to login UI.
 				   This can happen even if we have previously authenticated, but for some reason,
 				   like CCM delays, need to reauthenticate.
-				   Try to reauthenticate, then raise RTCError, and hope that retry logic works.
+				   do_curl reauthenticates, then raises RTCError, and hopes that retry logic works.
 				   '''
-				log.info('do_curl received HTTP response code 302, reauthenticating...')
-				self.reauthenticate()
+				raise AuthenticationRequired('RTC server requires authentication (RTC response code: 302)')
 			raise RTCError('unable to perform CURL operation (RTC response code: %s)'
 						   % rcode)
 		finally:
 			curl.close()
-		return self._last_response
-	def rest(self, path, data=None, options=None, headers=None):
+		return response
+	def rest(self, path, data=None, options=None, headers=None, idempotent=True):
+		'request path, sending data (if any) as body; see do_curl'
 		self.authenticate()
 		url = '%s/%s' % (self.server.url, path)
-		self._last_url = url
-		log.info('making rest call to "%s"' % url)
-		log.info('cookie file is "%s"' % self.cookie_file)
+		log.info('making rest call to "%s" (cookie file "%s")', url, self.cookie_file)
 		all_headers = ['Accept: application/x-oslc-cm-changerequest+json',
 					   'Content-Type: application/x-oslc-cm-changerequest+json']
 		if headers:
 			all_headers += headers
-		opts = {pycurl.HEADER:          1,
-				pycurl.HTTPHEADER:      all_headers}
+		opts = {pycurl.HTTPHEADER:      all_headers}
 		if options:
 			opts.update(options)
-		r = self.do_curl(opts, url)
-		return (r[:self._body_offset], r[self._body_offset:])
+		return self.do_curl(opts, url, data=data, idempotent=idempotent)
 	def discover(self, target_project_name):
 		'''
 		Discover important things about specified project
@@ -205,7 +404,7 @@ class RTC(object):
 			pass
 
 		root_svcs_url = '%s/%s' % (self.server.url, 'rootservices')
-		root_xml = self.do_curl(None, root_svcs_url)
+		root_xml = self.do_curl(None, root_svcs_url).body
 
 		# get root discovery document
 		root_disc_doc = minidom.parseString(root_xml)
@@ -213,7 +412,7 @@ class RTC(object):
 		# look up service provider catalog
 		service_providers = root_disc_doc.getElementsByTagName('oslc_cm:cmServiceProviders')[-1]
 		catalog_url = service_providers.getAttribute('rdf:resource')
-		catalog = minidom.parseString(self.do_curl(None, catalog_url))
+		catalog = minidom.parseString(self.do_curl(None, catalog_url).body)
 
 		# get list of service providers
 		service_providers = catalog.getElementsByTagName('oslc_disc:ServiceProvider')
@@ -229,7 +428,7 @@ class RTC(object):
 		services_url = target_project_el.getElementsByTagName('oslc_disc:services')[-1].getAttribute('rdf:resource')
 
 		# get service descriptor
-		service_descriptor = minidom.parseString(self.do_curl(None, services_url))
+		service_descriptor = minidom.parseString(self.do_curl(None, services_url).body)
 
 		# find default work item factory url
 		factories = service_descriptor.getElementsByTagName('oslc_cm:factory')
@@ -307,12 +506,11 @@ class WorkItem(object):
 		_json = self.template % {'title': 'template-generated work item',
 								   'description': 'a new work item generated from template created by rtc.py.',
 								   'type': t}
-		buf = StringIO.StringIO(_json)
-		options = { pycurl.READFUNCTION: FileReader(buf).read_callback,
-					pycurl.POSTFIELDSIZE: len(_json),
+		options = { pycurl.POSTFIELDSIZE: len(_json),
 					pycurl.POST: 1 }
-		self._headers, _json = self._rtc.rest(path=pd['WorkItemFactory'], options=options)
-		self._data = json.loads(_json)
+		r = self._rtc.rest(path=pd['WorkItemFactory'], data=_json, options=options, idempotent=False)
+		self._headers, _json = r.header_text, r.body
+		self._data = r.json()
 		self._etag = self._extract_etag(self._headers)
 		try:
 			return self._data['dc:identifier']
@@ -323,15 +521,12 @@ class WorkItem(object):
 						   % pformat(errinfo))
 	def flush(self):
 		_json = json.dumps(self._data)
-		buf = StringIO.StringIO(_json)
-		buflen = len(_json)
-		options = {pycurl.READFUNCTION: FileReader(buf).read_callback,
-				   pycurl.INFILESIZE: len(_json),
+		options = {pycurl.INFILESIZE: len(_json),
 				   pycurl.PUT: 1}
 		headers = ['If-Match: %s' % self._etag]
-		self._headers, _json = self._rtc.rest(path=('oslc/workitems/%s' % self.id),
-											  options=options, headers=headers)
-		self._data = json.loads(_json)
+		r = self._rtc.rest(path=('oslc/workitems/%s' % self.id), data=_json, options=options, headers=headers)
+		self._headers, _json = r.header_text, r.body
+		self._data = r.json()
 		self._etag = self._extract_etag(self._headers)
 		try:
 			return self._data['dc:identifier']
@@ -344,9 +539,10 @@ class WorkItem(object):
 		'fetch ".../ccm/oslc/workitems/%s" % self.id'
 		if self._data:
 			return
-		self._headers, _json = self._rtc.rest(path='oslc/workitems/%s' % self.id)
+		r = self._rtc.rest(path='oslc/workitems/%s' % self.id)
+		self._headers, _json = r.header_text, r.body
 		try:
-			self._data = json.loads(_json)
+			self._data = r.json()
 			self._etag = self._extract_etag(self._headers)
 		except:
 			raise RTCError('failure in work item retrieval or parsing:\njson:%s\nheaders:%s' % (_json, self._headers))
@@ -0,0 +1,84 @@
+'''
+sharded check-in: concurrent change sets from several RTC workspaces
+'''
+import re
+import logging
+from mtconfig import ConfigError
+
+log = logging.getLogger('sharding')
+
+class Shard(object):
+	'''
+	An RTC repository workspace flowing to the migration stream, its
+	sandbox, and the lscm CLI (daemon) serving that sandbox.
+
+	All lscm commands run with the sandbox as their working directory, so
+	shards can be used from several threads.
+	'''
+	def __init__(self, cli, workspace, sandbox, ccm_versions):
+		self.cli, self.workspace, self.sandbox = cli, workspace, sandbox
+		self.task_pred_dir = '%s/%s' % (sandbox, ccm_versions)
+	def __repr__(self):
+		return 'Shard(%r, %r)' % (self.workspace, self.sandbox)
+	def accept(self):
+		self.cli.accept(cwd=self.sandbox)
+	def deliver(self):
+		# catch up first: change sets delivered by other shards since this
+		# one last accepted touch other files, so they do not conflict.
+		self.cli.accept(cwd=self.sandbox)
+		self.cli.deliver(cwd=self.sandbox)
+
+def shard_settings(shards):
+	'return [(workspace, sandbox), ...] from mt_config.rtc.shards, raise ConfigError if invalid'
+	try:
+		return [(s['workspace'], s['sandbox']) for s in shards]
+	except (KeyError, TypeError):
+		raise ConfigError('"mt_config.rtc.shards" must be a list of {\'workspace\': ..., \'sandbox\': ...}')
+
+def task_order(task):
+	'sort key for CCM task order, e.g. "cup=9999" before "cup=10000"'
+	m = re.match(r'(.*?)(\d+)$', task)
+	return (m.group(1), int(m.group(2))) if m else (task, 0)
+
+def conflicts(objects):
+	'''
+	return file-overlap conflict graph {task: set of conflicting tasks},
+	given objects {task: keys of the objects (files, directories) it changes}.
+
+	keys are (name, type, instance), not paths, so objects of the same name
+	in different directories count as conflicting; that costs concurrency,
+	never correctness.
+	'''
+	owners = dict()					# object key -> tasks
+	for t, keys in objects.items():
+		for k in keys:
+			owners.setdefault(k, set()).add(t)
+	graph = dict([(t, set()) for t in objects])
+	for tasks in owners.values():
+		for t in tasks:
+			graph[t] |= tasks
+	for t in graph:
+		graph[t].discard(t)
+	return graph
+
+def waves(tasks, graph, width):
+	'''
+	schedule tasks (in CCM task order) into waves of at most width
+	mutually non-conflicting tasks; return list of waves (lists of tasks).
+
+	each task goes into the earliest wave with room after every wave
+	holding a conflicting earlier task, so conflicting tasks are checked in
+	and delivered in CCM task order, and within a wave tasks remain in CCM
+	task order.
+	'''
+	schedule, where = list(), dict()
+	for t in tasks:
+		i = max([where[u] + 1 for u in graph.get(t, ()) if u in where] or [0])
+		while i < len(schedule) and len(schedule[i]) >= width:
+			i += 1
+		if i == len(schedule):
+			schedule.append(list())
+		schedule[i].append(t)
+		where[t] = i
+	log.debug('%d tasks scheduled in %d waves of at most %d', len(tasks), len(schedule), width)
+	return schedule
@@ -0,0 +1,95 @@
+'''
+local index of migrated tasks: CCM task -> change set -> work item -> baseline -> delivery
+'''
+import os.path, sqlite3, threading, time
+import logging
+from collections import namedtuple
+from sharding import task_order
+
+log = logging.getLogger('taskindex')
+
+Entry = namedtuple('Entry', 'task changeset work_item baseline delivered')
+
+class TaskIndex(object):
+	'''
+	Where each migrated CCM task went in RTC: its change set, its metadata
+	work item, the baseline it was migrated for, and when its change set
+	was delivered (seconds since the epoch, None if not yet).
+
+	The index is an SQLite database at path (in memory if path is None),
+	updated as soon as each change set or work item exists, so that a rerun
+	reuses work items instead of creating duplicates. Entries may be
+	recorded from several threads (see add_tasks_sharded).
+
+	If readonly is set, the database must exist, and is neither created
+	nor modified (e.g. by "ccm2rtc index show").
+	'''
+	max_vars = 500					# host parameters per statement (SQLite allows 999)
+	def __init__(self, path=None, readonly=False):
+		self.path = path
+		self._lock = threading.Lock()
+		if readonly and not (path and os.path.isfile(path)):
+			raise IOError('no task index "%s"' % path)
+		self._db = sqlite3.connect(path or ':memory:', check_same_thread=False)
+		self._db.text_factory = str		# ids end up in lscm command lines
+		if readonly:
+			self._db.execute('pragma query_only = on')
+			return
+		self._db.execute('''create table if not exists tasks (task      text primary key,
+															  changeset text,
+															  work_item text,
+															  baseline  text,
+															  delivered real)''')
+		self._db.execute('create index if not exists tasks_baseline on tasks (baseline)')
+		self._db.commit()
+	def close(self):
+		with self._lock:
+			self._db.close()
+	def _update(self, sql, *args):
+		with self._lock:
+			self._db.execute(sql, args)
+			self._db.commit()
+	def get(self, task):
+		'return Entry of task, or None if it is not in the index'
+		return self.lookup([task]).get(task)
+	def lookup(self, tasks):
+		'return {task: Entry} for those of tasks that are in the index'
+		tasks, found = list(tasks), dict()
+		with self._lock:
+			for i in xrange(0, len(tasks), self.max_vars):
+				chunk = tasks[i:i+self.max_vars]
+				for row in self._db.execute('select * from tasks where task in (%s)' % ','.join('?' * len(chunk)), chunk):
+					found[row[0]] = Entry(*row)
+		return found
+	def entries(self, baseline=None):
+		'return list of Entry, of all tasks or of those migrated for baseline, in CCM task order'
+		with self._lock:
+			if baseline is None:
+				rows = self._db.execute('select * from tasks').fetchall()
+			else:
+				rows = self._db.execute('select * from tasks where baseline = ?', (baseline,)).fetchall()
+		return sorted([Entry(*row) for row in rows], key=lambda e: task_order(e.task))
+	def checked_in(self, task, changeset, baseline):
+		'record change set of task (keeping its work item, if any)'
+		log.debug('task "%s": change set %s, baseline "%s"', task, changeset, baseline)
+		with self._lock:
+			self._db.execute('insert or ignore into tasks (task) values (?)', (task,))
+			self._db.execute('update tasks set changeset = ?, baseline = ?, delivered = null where task = ?',
+							 (changeset, baseline, task))
+			self._db.commit()
+	def work_item(self, task, work_item):
+		'record metadata work item of task'
+		log.debug('task "%s": work item %s', task, work_item)
+		self._update('update tasks set work_item = ? where task = ?', work_item, task)
+	def undelivered(self, baseline):
+		'return tasks migrated for baseline whose change sets are not delivered yet'
+		with self._lock:
+			rows = self._db.execute('select task from tasks where baseline = ? and changeset is not null and delivered is null',
+									(baseline,)).fetchall()
+		return [row[0] for row in rows]
+	def delivered(self, tasks, when=None):
+		'record delivery of the change sets of tasks (at when, default: now)'
+		when = when or time.time()
+		with self._lock:
+			self._db.executemany('update tasks set delivered = ? where task = ?', [(when, t) for t in tasks])
+			self._db.commit()
@@ -0,0 +1,69 @@
+import os, shutil, tempfile, unittest
+import calltrace, ccm
+
+def records(*rows):
+	'ccm query output of rows'
+	return ''.join([ccm.FIELD_SEP.join(r) + ccm.RECORD_SEP + '\n' for r in rows])
+
+def fake_ccm(trace, output, error=None):
+	'''
+	return CCM whose stream() prints output (then raises error, if any),
+	hooked like Recorder/Player.install() would, without a CCM session
+	'''
+	class FakeCCM(ccm.CCM):
+		def __init__(self):
+			self.streamed = list()
+		def stream(self, cmd, ccm_opts=''):
+			self.streamed.append(cmd)
+			yield output
+			if error:
+				raise error
+	FakeCCM.stream = trace._wrap_stream(vars(FakeCCM)['stream'], 'ccm stream', calltrace._ccm_stream_key)
+	return FakeCCM()
+
+class RecordReplayTest(unittest.TestCase):
+	output = records(('completed', 'joe'), ('released', 'ann'))
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.path = os.path.join(self.dir, 'trace.gz')
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+	def record(self, session, error=None):
+		recorder = calltrace.Recorder(self.path)
+		try:
+			return session(fake_ccm(recorder, self.output, error)), recorder.calls
+		finally:
+			recorder.close()
+	def replay(self, session):
+		player = calltrace.Player(self.path)
+		c = fake_ccm(player, 'output of an unexpected ccm run')
+		try:
+			return session(c), player.unused(), c.streamed
+		finally:
+			player.close()
+	def test_query(self):
+		session = lambda c: [tuple(r) for r in c.query('type=task', ['status', 'resolver'])]
+		recorded, calls = self.record(session)
+		self.assertEqual(calls, 1)
+		self.assertEqual(self.replay(session), ([('completed', 'joe'), ('released', 'ann')], 0, []))
+	def test_query_read_with_next(self):
+		# e.g. fetch_task_info: the stream is closed after the first record
+		session = lambda c: tuple(next(c.query("task('cup=1')", ['status', 'resolver']), None))
+		recorded, calls = self.record(session)
+		self.assertEqual(calls, 1)
+		self.assertEqual(self.replay(session), (('completed', 'joe'), 0, []))
+	def test_error(self):
+		def session(c):
+			out = list()
+			try:
+				for chunk in c.stream('query x'):
+					out.append(chunk)
+			except ccm.CCMError:
+				return out
+			self.fail('error not raised')
+		recorded, calls = self.record(session, ccm.CCMError('ccm failed'))
+		self.assertEqual((recorded, calls), ([self.output], 1))
+		self.assertEqual(self.replay(session), ([self.output], 0, []))
+
+if __name__ == '__main__':
+	unittest.main()
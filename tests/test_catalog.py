@@ -0,0 +1,42 @@
+import os, shutil, tempfile, unittest
+from collections import namedtuple
+from datetime import datetime as dt
+from catalog import BaselineCatalog
+from mtconfig import ConfigError
+
+Baseline = namedtuple('Baseline', 'displayname create_time')
+
+class BaselineCatalogTest(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.path = os.path.join(self.dir, 'sync')
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+	def test_add(self):
+		c = BaselineCatalog(self.path, 'r1')
+		self.assertEqual(c.newest(), None)
+		self.assertEqual(c.add([Baseline('bl1', dt(2026, 1, 1)), Baseline('bl2', dt(2026, 1, 2))]), ['bl1', 'bl2'])
+		# baselines created at the "since" time of a query are returned again
+		self.assertEqual(c.add([Baseline('bl2', dt(2026, 1, 2)), Baseline('bl3', dt(2026, 1, 3))]), ['bl3'])
+		self.assertEqual(c.newest(), dt(2026, 1, 3))
+		self.assertTrue('bl2' in c and 'bl4' not in c)
+	def test_pending(self):
+		c = BaselineCatalog(None, 'r1')
+		c.add([Baseline('bl%d' % i, dt(2026, 1, i)) for i in xrange(1, 5)])
+		c.set_migrated('bl2')
+		self.assertEqual(c.pending(), ['bl3', 'bl4'])
+		c.set_migrated('bl4')
+		self.assertEqual(c.pending(), [])
+	def test_persistence(self):
+		c = BaselineCatalog(self.path, 'r1')
+		c.add([Baseline('bl1', dt(2026, 1, 1)), Baseline('bl2', dt(2026, 1, 2))])
+		c.set_migrated('bl1')
+		c = BaselineCatalog(self.path, 'r1')
+		self.assertEqual([name for name, t in c.baselines], ['bl1', 'bl2'])
+		self.assertEqual((c.migrated, c.pending(), c.newest()), ('bl1', ['bl2'], dt(2026, 1, 2)))
+	def test_other_release(self):
+		BaselineCatalog(self.path, 'r1').add([Baseline('bl1', dt(2026, 1, 1))])
+		self.assertRaises(ConfigError, BaselineCatalog, self.path, 'r2')
+
+if __name__ == '__main__':
+	unittest.main()
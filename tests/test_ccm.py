@@ -0,0 +1,86 @@
+import unittest
+from datetime import datetime as dt
+import ccm
+
+def records(*rows):
+	'ccm query output of rows'
+	return ''.join([ccm.FIELD_SEP.join(r) + ccm.RECORD_SEP + '\n' for r in rows])
+
+class FakeCCM(ccm.CCM):
+	'''
+	CCM without a session: stream() answers each command with the output
+	of the first matching (pattern, output) in script; output is a list of
+	chunks, possibly followed by an exception to raise.
+	'''
+	query_delay = 0
+	def __init__(self, script):
+		self.script = script
+		self.streamed = list()
+	def stream(self, cmd, ccm_opts=''):
+		self.streamed.append(cmd)
+		for pattern, output in self.script:
+			if pattern in cmd:
+				break
+		else:
+			raise ccm.CCMError('unexpected command %s' % cmd)
+		for chunk in output:
+			if isinstance(chunk, Exception):
+				raise chunk
+			yield chunk
+
+class QueryTest(unittest.TestCase):
+	def test_records(self):
+		out = records(('cup=1', 'Mon Oct 19 11:39:45 2026', 'cup=1, cup=2'), ('cup=3', '<void>', ''))
+		# split records (and separators) across chunks
+		c = FakeCCM([('query', [out[:5], out[5:30], out[30:]])])
+		r = list(c.query('type=task', ['displayname', 'create_time', 'task']))
+		self.assertEqual([tuple(x) for x in r], [('cup=1', dt(2026, 10, 19, 11, 39, 45), ('cup=1', 'cup=2')),
+												  ('cup=3', None, ())])
+		self.assertEqual((r[0].displayname, r[1].create_time), ('cup=1', None))
+		self.assertTrue(type(r[0]) is type(r[1]) is ccm.record_type(['displayname', 'create_time', 'task']))
+	def test_invalid_record(self):
+		c = FakeCCM([('query', [records(('a', 'b'), ('only one',), ('c', 'd'))])])
+		self.assertEqual([tuple(r) for r in c.query('x', ['status', 'resolver'])], [('a', 'b'), ('c', 'd')])
+	def test_types(self):
+		c = FakeCCM([('query', [records(('7',))])])
+		self.assertEqual(list(c.query('x', ['cr_number'], types={'cr_number': int}))[0].cr_number, 7)
+	def test_chunks(self):
+		c = FakeCCM([('query', [records(('o',))])])
+		terms = ["is_predecessor_of('o%d')" % i for i in xrange(5)]
+		self.assertEqual(len(list(c.query(terms, ['objectname'], chunk=2))), 3)
+		self.assertEqual(len(c.streamed), 3)
+		self.assertTrue(" or ".join(terms[:2]) in c.streamed[0])
+		self.assertTrue(terms[4] in c.streamed[2] and ' or ' not in c.streamed[2])
+	def test_retry(self):
+		c = FakeCCM([('query', [ccm.CCMError('busy')])])
+		c.query_tries = 3
+		self.assertRaises(ccm.CCMError, list, c.query('x', ['objectname']))
+		self.assertEqual(len(c.streamed), 3)
+	def test_no_retry_after_records(self):
+		# records already returned cannot be taken back
+		c = FakeCCM([('query', [records(('o',)), ccm.CCMError('lost')])])
+		q = c.query('x', ['objectname'])
+		self.assertEqual(tuple(next(q)), ('o',))
+		self.assertRaises(ccm.CCMError, list, q)
+		self.assertEqual(len(c.streamed), 1)
+	def test_failok(self):
+		# a failing term fails the whole expression; the others are still found,
+		# and the records of the failed chunk are not returned twice
+		c = FakeCCM([("'bad') or", [records(('o1',)), ccm.CCMError('no such object')]),
+					 ("'bad')", [ccm.CCMError('no such object')]),
+					 ("'o1')", [records(('o1',))]),
+					 ("'o3')", [records(('o3',))])])
+		r = c.query(["is_predecessor_of('o1')", "is_predecessor_of('bad')", "is_predecessor_of('o3')"],
+					['objectname'], failok=True)
+		self.assertEqual([x.objectname for x in r], ['o1', 'o3'])
+		self.assertEqual(len(c.streamed), 4)
+
+class TaskObjectsTest(unittest.TestCase):
+	def test_task_objects(self):
+		c = FakeCCM([('task -show objects', [records(('f.c~1:csrc:1', 'joe'))])])
+		r = c.task_objects('cup=1', ['objectname', 'owner'])
+		self.assertEqual([tuple(x) for x in r], [('f.c~1:csrc:1', 'joe')])
+		self.assertTrue("'cup=1'" in c.streamed[0])
+
+if __name__ == '__main__':
+	unittest.main()
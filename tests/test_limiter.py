@@ -0,0 +1,69 @@
+import unittest
+import limiter
+
+class LimiterTest(unittest.TestCase):
+	def test_increase(self):
+		l = limiter.Limiter('test', initial=4, maximum=5)
+		l.acquire()
+		l.release(0.1, True)
+		self.assertAlmostEqual(l.limit, 4.25)
+		for i in xrange(20):
+			l.acquire()
+			l.release(0.1, True)
+		self.assertEqual(l.limit, 5)
+	def test_decrease_once_per_latency(self):
+		l = limiter.Limiter('test', initial=8, backoff=0.5)
+		l.acquire()
+		l.release(60, False)
+		self.assertEqual(l.limit, 4)
+		# a burst of errors within one mean latency counts once
+		l.acquire()
+		l.release(60, False)
+		self.assertEqual(l.limit, 4)
+		self.assertEqual(l.errors, 2)
+	def test_minimum(self):
+		l = limiter.Limiter('test', initial=2, minimum=1)
+		for i in xrange(3):
+			l._decreased = 0
+			l.acquire()
+			l.release(0.1, False)
+		self.assertEqual(l.limit, 1)
+	def test_slow_response(self):
+		l = limiter.Limiter('test', initial=4, max_latency=1)
+		l.acquire()
+		l.release(2, True)
+		self.assertEqual(l.limit, 2)
+		self.assertEqual(l.errors, 0)
+	def test_slot(self):
+		l = limiter.Limiter('test', initial=4)
+		with l.slot():
+			self.assertEqual(l.inflight, 1)
+		self.assertEqual((l.inflight, l.errors), (0, 0))
+		try:
+			with l.slot():
+				raise ValueError
+		except ValueError:
+			pass
+		self.assertEqual((l.inflight, l.errors, l.limit), (0, 1, (4 + 0.25) * 0.5))
+	def test_slot_ignore(self):
+		l = limiter.Limiter('test', initial=4)
+		try:
+			with l.slot(ignore=(KeyError,)):
+				raise KeyError
+		except KeyError:
+			pass
+		self.assertEqual((l.inflight, l.errors, l.limit), (0, 0, 4.25))
+	def test_limited(self):
+		limiter.limiters['test'] = l = limiter.Limiter('test', initial=4)
+		@limiter.limited('test', ignore=(KeyError,))
+		def f(e):
+			raise e
+		try:
+			self.assertRaises(KeyError, f, KeyError)
+			self.assertRaises(ValueError, f, ValueError)
+		finally:
+			del limiter.limiters['test']
+		self.assertEqual((l.requests, l.errors), (2, 1))
+
+if __name__ == '__main__':
+	unittest.main()
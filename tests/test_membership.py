@@ -0,0 +1,42 @@
+import os, shutil, tempfile, unittest
+from membership import MembershipIndex
+
+class MembershipIndexTest(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+	def test_compare(self):
+		index = MembershipIndex()
+		index.add('bl1', ['cup=1', 'cup=2'])
+		index.add('bl2', ['cup=2', 'cup=3', 'cup=4'])
+		self.assertEqual(index.compare('bl1', 'bl2'), (set(['cup=3', 'cup=4']), set(['cup=1'])))
+		self.assertEqual(index.members('bl2'), set(['cup=2', 'cup=3', 'cup=4']))
+		self.assertEqual(index.members('bl1'), set(['cup=1', 'cup=2']))
+	def test_persistence(self):
+		path = os.path.join(self.dir, 'index')
+		index = MembershipIndex(path)
+		index.add('bl1', ['cup=1'])
+		index.add('bl2', ['cup=1', 'cup=2'])
+		index.save()
+		index = MembershipIndex(path)
+		self.assertEqual(index.baselines, ['bl1', 'bl2'])
+		self.assertTrue('bl2' in index)
+		self.assertEqual(index.compare('bl1', 'bl2'), (set(['cup=2']), set()))
+	def test_refresh_fetches_new_baselines_only(self):
+		class FakeCCM(object):
+			fetched = list()
+			def baseline_project(self, bl, pjt_name):
+				self.fetched.append(bl)
+				return bl
+			def project_tasks(self, project):
+				return set(['%s-task' % project])
+		ccm = FakeCCM()
+		index = MembershipIndex()
+		index.add('bl1', ['cup=1'])
+		index.refresh(ccm, ['bl1', 'bl2'])
+		self.assertEqual(ccm.fetched, ['bl2'])
+		self.assertEqual(index.members('bl2'), set(['bl2-task']))
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,73 @@
+import os, tempfile, unittest
+import mtconfig
+
+required = '''
+mt_config.ccm.host = 'h'
+mt_config.ccm.db = '/db'
+mt_config.ccm.project = 'p'
+mt_config.ccm.work_area = '/wa'
+mt_config.ccm.baseline_initial = 'bl1'
+mt_config.ccm.release = 'r'
+mt_config.ccm.purposes = ['Integration Testing']
+mt_config.rtc.host = 'h'
+mt_config.rtc.root = 'ccm'
+mt_config.rtc.project = 'p'
+mt_config.rtc.stream = 's'
+mt_config.rtc.workspace = 'ws'
+mt_config.rtc.sandbox = '/sb'
+mt_config.rtc.work_item = '1'
+mt_config.rtc.ccm_versions = 'ccm'
+'''
+
+class ParseConfigTest(unittest.TestCase):
+	def parse(self, text):
+		fd, path = tempfile.mkstemp()
+		try:
+			os.write(fd, text)
+			os.close(fd)
+			return mtconfig.parse_config(path)
+		finally:
+			os.remove(path)
+	def test_valid(self):
+		values, problems = self.parse(required + "mt_config.migration.log_cap = 100\n")
+		self.assertEqual(problems, [])
+		self.assertEqual(values[('migration', 'log_cap')], 100)
+	def test_missing_required(self):
+		values, problems = self.parse(required.replace("mt_config.ccm.host = 'h'\n", ''))
+		self.assertEqual(len(problems), 1)
+		self.assertTrue('"mt_config.ccm.host" is required' in problems[0])
+	def test_unknown_element(self):
+		values, problems = self.parse(required + "mt_config.ccm.hots = 'h'\n")
+		self.assertTrue('unknown configuration element "mt_config.ccm.hots"' in problems[0])
+	def test_wrong_type(self):
+		values, problems = self.parse(required + "mt_config.migration.log_cap = '100'\n")
+		self.assertTrue('must be a int' in problems[0])
+	def test_not_a_literal(self):
+		values, problems = self.parse(required + "mt_config.ccm.host = os.getenv('HOST')\n")
+		self.assertTrue('is not a literal' in problems[0])
+	def test_not_an_assignment(self):
+		values, problems = self.parse(required + "import os\n")
+		self.assertTrue('not an assignment' in problems[0])
+	def test_invalid_values(self):
+		for line, problem in [("mt_config.migration.log_level = 'info'", 'must be a logging level'),
+							  ("mt_config.migration.log_levels = {'ccm': 'verbose'}", 'invalid level \'verbose\' for "ccm"'),
+							  ("mt_config.migration.verify = 'fial'", "must be 'off', 'warn' or 'fail'"),
+							  ("mt_config.migration.limits = {'rst': {}}", 'unknown backend "rst"'),
+							  ("mt_config.migration.limits = {'ccm': {'maxmum': 4}}", 'unknown setting "maxmum"'),
+							  ("mt_config.migration.limits = {'ccm': {'maximum': '4'}}", 'non-numeric setting "maximum"'),
+							  ("mt_config.rtc.shards = [{'workspace': 'ws2'}]", 'must be a list of')]:
+			values, problems = self.parse(required + line + '\n')
+			self.assertEqual(len(problems), 1, line)
+			self.assertTrue(problem in problems[0], problems[0])
+	def test_valid_values(self):
+		values, problems = self.parse(required + """
+mt_config.migration.log_level = 'WARNING'
+mt_config.migration.log_levels = {'ccm': 'DEBUG'}
+mt_config.migration.verify = 'fail'
+mt_config.migration.limits = {'ccm': {'initial': 2, 'maximum': 4}, 'rest': {'backoff': 0.5, 'max_latency': 30}}
+mt_config.rtc.shards = [{'workspace': 'ws2', 'sandbox': '/sb2'}]
+""")
+		self.assertEqual(problems, [])
+
+if __name__ == '__main__':
+	unittest.main()
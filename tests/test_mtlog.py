@@ -0,0 +1,68 @@
+import gzip, logging, os, shutil, tempfile, unittest
+import mtlog
+
+def record(msg, *args):
+	return logging.LogRecord('ccm', logging.INFO, __file__, 1, msg, args, None)
+
+def read(path):
+	f = gzip.open(path)
+	try:
+		return f.read()
+	finally:
+		f.close()
+
+class LazyTest(unittest.TestCase):
+	def test_lazy(self):
+		calls = list()
+		lazy = mtlog.Lazy(lambda x: calls.append(x) or x * 2, 21)
+		self.assertEqual(calls, [])
+		self.assertEqual(record('%s', lazy).getMessage(), '42')
+		self.assertEqual(calls, [21])
+
+class CapFilterTest(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+	def test_short(self):
+		r = record('%s and %s', 'a', 'b')
+		self.assertTrue(mtlog.CapFilter(10).filter(r))
+		self.assertEqual((r.msg, r.args), ('a and b', ()))
+	def test_truncated(self):
+		r = record('%s', 'x' * 25)
+		mtlog.CapFilter(10).filter(r)
+		self.assertEqual(r.getMessage(), 'x' * 10 + ' [... 15 bytes truncated, full text: not saved]')
+	def test_spilled(self):
+		spill = mtlog.Spill(os.path.join(self.dir, 'spill'))
+		f = mtlog.CapFilter(10, spill)
+		r1, r2 = record('%s', 'x' * 25), record('%s', 'y' * 25)
+		f.filter(r1)
+		f.filter(r2)
+		self.assertTrue(r2.getMessage().endswith('full text: %s #2]' % spill.path))
+		text = read(spill.path)
+		self.assertTrue(text.startswith('=== #1 '))
+		self.assertTrue(' ccm INFO\n%s\n=== #2 ' % ('x' * 25) in text)
+		self.assertTrue(text.endswith('y' * 25 + '\n'))
+
+class SpillTest(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+	def test_rotate(self):
+		spill = mtlog.Spill(self.dir, max_bytes=1, backups=2)
+		for i in xrange(4):
+			spill.write(record('m'), 'message %d' % i)
+		self.assertEqual(sorted(os.listdir(self.dir)), ['spill.log.1.gz', 'spill.log.2.gz', 'spill.log.gz'])
+		self.assertTrue(read(spill.path).endswith('message 3\n'))
+		self.assertTrue(read(os.path.join(self.dir, 'spill.log.1.gz')).endswith('message 2\n'))
+		self.assertTrue(read(os.path.join(self.dir, 'spill.log.2.gz')).endswith('message 1\n'))
+	def test_no_backups(self):
+		spill = mtlog.Spill(self.dir, max_bytes=1, backups=0)
+		spill.write(record('m'), 'message 1')
+		spill.write(record('m'), 'message 2')
+		self.assertEqual(os.listdir(self.dir), ['spill.log.gz'])
+		self.assertTrue(read(spill.path).endswith('message 2\n'))
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,37 @@
+import unittest
+try:
+	import rtc
+except ImportError:					# pycurl missing
+	rtc = None
+
+@unittest.skipIf(rtc is None, 'rtc needs pycurl')
+class ResponseTest(unittest.TestCase):
+	def test_response(self):
+		r = rtc.Response()
+		for line in ['HTTP/1.1 200 OK\r\n', 'ETag: "abc"\r\n', 'Content-Type: application/json\r\n', '\r\n']:
+			r.header_callback(line)
+		r.write_callback('{"dc:identifier"')
+		r.write_callback(': "42"}')
+		self.assertEqual((r.status, r.headers['etag'], r.size), (200, '"abc"', 23))
+		self.assertEqual(r.body, '{"dc:identifier": "42"}')
+		self.assertEqual(r.json(), {'dc:identifier': '42'})
+		self.assertTrue(r.json() is r.json())
+		self.assertTrue(r.header_text.startswith('HTTP/1.1 200 OK\r\nETag: "abc"\r\n'))
+	def test_redirect(self):
+		# only the final response of a followed redirect is kept
+		r = rtc.Response()
+		r.header_callback('HTTP/1.1 302 Found\r\n')
+		r.header_callback('Location: /login\r\n')
+		r.write_callback('moved')
+		r.header_callback('HTTP/1.1 200 OK\r\n')
+		r.write_callback('final')
+		self.assertEqual((r.status, r.headers, r.body, r.header_text), (200, {}, 'final', 'HTTP/1.1 200 OK\r\n'))
+	def test_too_large(self):
+		r = rtc.Response(max_body=8)
+		self.assertEqual(r.write_callback('12345'), None)
+		self.assertEqual(r.write_callback('67890'), 0)
+		self.assertTrue(r.too_large)
+		self.assertEqual(r.body, '12345')
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,43 @@
+import random, unittest
+import sharding
+
+class TaskOrderTest(unittest.TestCase):
+	def test_numeric(self):
+		tasks = ['cup=10000', 'cup=9999', 'cup=25637', 'abc=2']
+		self.assertEqual(sorted(tasks, key=sharding.task_order), ['abc=2', 'cup=9999', 'cup=10000', 'cup=25637'])
+
+class ConflictsTest(unittest.TestCase):
+	def test_graph(self):
+		g = sharding.conflicts({'t1': ['a', 'b'], 't2': ['b'], 't3': ['c'], 't4': []})
+		self.assertEqual(g, {'t1': set(['t2']), 't2': set(['t1']), 't3': set(), 't4': set()})
+
+class WavesTest(unittest.TestCase):
+	def test_conflicting_tasks_keep_order(self):
+		tasks = ['cup=1', 'cup=2', 'cup=3', 'cup=4']
+		g = sharding.conflicts({'cup=1': ['a'], 'cup=2': ['b'], 'cup=3': ['a'], 'cup=4': ['c']})
+		self.assertEqual(sharding.waves(tasks, g, 2), [['cup=1', 'cup=2'], ['cup=3', 'cup=4']])
+		self.assertEqual(sharding.waves(tasks, g, 3), [['cup=1', 'cup=2', 'cup=4'], ['cup=3']])
+	def test_width_one_is_serial(self):
+		tasks = ['cup=1', 'cup=2', 'cup=3']
+		g = sharding.conflicts(dict([(t, []) for t in tasks]))
+		self.assertEqual(sharding.waves(tasks, g, 1), [['cup=1'], ['cup=2'], ['cup=3']])
+	def test_random(self):
+		rnd = random.Random(1)
+		for n in xrange(50):
+			tasks = ['cup=%d' % i for i in xrange(rnd.randint(1, 40))]
+			objects = dict([(t, rnd.sample('abcdefghij', rnd.randint(0, 3))) for t in tasks])
+			g = sharding.conflicts(objects)
+			width = rnd.randint(1, 5)
+			schedule = sharding.waves(tasks, g, width)
+			where = dict([(t, i) for i, w in enumerate(schedule) for t in w])
+			self.assertEqual(sorted(where, key=sharding.task_order), tasks)
+			for w in schedule:
+				self.assertTrue(len(w) <= width)
+				self.assertEqual(w, sorted(w, key=sharding.task_order))
+			for i, t in enumerate(tasks):
+				for u in tasks[i+1:]:
+					if u in g[t]:
+						self.assertTrue(where[t] < where[u], '%s before %s' % (t, u))
+
+if __name__ == '__main__':
+	unittest.main()
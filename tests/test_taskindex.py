@@ -0,0 +1,51 @@
+import os, shutil, sqlite3, tempfile, unittest
+from taskindex import TaskIndex
+
+class TaskIndexTest(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.path = os.path.join(self.dir, 'index')
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+	def test_lifecycle(self):
+		index = TaskIndex()
+		self.assertEqual(index.get('cup=1'), None)
+		index.checked_in('cup=1', 'cs1', 'bl1')
+		index.work_item('cup=1', '42')
+		index.checked_in('cup=2', 'cs2', 'bl1')
+		self.assertEqual(index.undelivered('bl1'), ['cup=1', 'cup=2'])
+		index.delivered(['cup=1'], when=1000)
+		self.assertEqual(index.undelivered('bl1'), ['cup=2'])
+		self.assertEqual(tuple(index.get('cup=1')), ('cup=1', 'cs1', '42', 'bl1', 1000))
+		# a rerun keeps the work item, but the new change set is not delivered yet
+		index.checked_in('cup=1', 'cs3', 'bl2')
+		self.assertEqual(tuple(index.get('cup=1')), ('cup=1', 'cs3', '42', 'bl2', None))
+		self.assertTrue(isinstance(index.get('cup=1').changeset, str))
+	def test_lookup_many(self):
+		index = TaskIndex()
+		index.max_vars = 3
+		for i in xrange(10):
+			index.checked_in('cup=%d' % i, 'cs%d' % i, 'bl1')
+		found = index.lookup(['cup=%d' % i for i in xrange(5, 15)])
+		self.assertEqual(sorted(found), ['cup=5', 'cup=6', 'cup=7', 'cup=8', 'cup=9'])
+		self.assertEqual(found['cup=7'].changeset, 'cs7')
+	def test_entries_in_task_order(self):
+		index = TaskIndex()
+		for task, bl in [('cup=10000', 'bl2'), ('cup=9999', 'bl1'), ('cup=25637', 'bl2')]:
+			index.checked_in(task, 'cs', bl)
+		self.assertEqual([e.task for e in index.entries()], ['cup=9999', 'cup=10000', 'cup=25637'])
+		self.assertEqual([e.task for e in index.entries('bl2')], ['cup=10000', 'cup=25637'])
+	def test_persistence(self):
+		index = TaskIndex(self.path)
+		index.checked_in('cup=1', 'cs1', 'bl1')
+		index.close()
+		index = TaskIndex(self.path, readonly=True)
+		self.assertEqual(index.get('cup=1').changeset, 'cs1')
+		self.assertRaises(sqlite3.OperationalError, index.checked_in, 'cup=2', 'cs2', 'bl1')
+		index.close()
+	def test_readonly_missing(self):
+		self.assertRaises(IOError, TaskIndex, self.path, readonly=True)
+		self.assertFalse(os.path.exists(self.path))
+
+if __name__ == '__main__':
+	unittest.main()
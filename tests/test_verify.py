@@ -0,0 +1,56 @@
+import os, shutil, tempfile, unittest
+import verify
+
+class CompareTest(unittest.TestCase):
+	def setUp(self):
+		self.dir = tempfile.mkdtemp()
+		self.a, self.b = os.path.join(self.dir, 'a'), os.path.join(self.dir, 'b')
+	def tearDown(self):
+		shutil.rmtree(self.dir)
+	def write(self, root, path, text):
+		p = os.path.join(root, path)
+		if not os.path.isdir(os.path.dirname(p)):
+			os.makedirs(os.path.dirname(p))
+		f = open(p, 'w')
+		try:
+			f.write(text)
+		finally:
+			f.close()
+	def test_identical(self):
+		for root in self.a, self.b:
+			self.write(root, 'src/f', 'same')
+			os.symlink('f', os.path.join(root, 'src/l'))
+		r = verify.compare(self.a, self.b)
+		self.assertFalse(r)
+		self.assertEqual(str(r), 'trees are identical')
+	def test_differences(self):
+		self.write(self.a, 'only_a', '')
+		self.write(self.b, 'only_b', '')
+		self.write(self.a, 'size', 'a')
+		self.write(self.b, 'size', 'bb')
+		self.write(self.a, 'content', 'a')
+		self.write(self.b, 'content', 'b')
+		os.symlink('x', os.path.join(self.a, 'link'))
+		os.symlink('y', os.path.join(self.b, 'link'))
+		r = verify.compare(self.a, self.b)
+		self.assertEqual((r.only_a, r.only_b, r.differ), (['only_a'], ['only_b'], ['content', 'link', 'size']))
+	def test_excluded(self):
+		# ccm_versions is excluded only at the root, .jazz5 at any depth
+		self.write(self.a, 'ccm/f', 'a')
+		self.write(self.a, 'src/.jazz5/f', 'a')
+		self.write(self.a, 'src/ccm/f', 'a')
+		self.write(self.b, 'src/ccm/f', 'b')
+		r = verify.compare(self.a, self.b, excluded=['ccm'])
+		self.assertEqual((r.only_a, r.only_b, r.differ), ([], [], ['src/ccm/f']))
+	def test_hash_cache(self):
+		self.write(self.a, 'f', 'a')
+		self.write(self.b, 'f', 'b')
+		path = os.path.join(self.dir, 'cache')
+		self.assertTrue(verify.compare(self.a, self.b, cache=verify.HashCache(path)))
+		cache = verify.HashCache(path)
+		self.assertEqual(len(cache._entries), 2)
+		self.write(self.b, 'f', 'a')
+		self.assertFalse(verify.compare(self.a, self.b, cache=cache))
+
+if __name__ == '__main__':
+	unittest.main()
@@ -0,0 +1,121 @@
+'''
+tree equivalence check between CCM work area and RTC sandbox
+'''
+import cPickle, hashlib, os, os.path, stat, threading
+import logging
+from multiprocessing.pool import ThreadPool
+
+log = logging.getLogger('verify')
+
+class VerifyError(Exception):
+	pass
+
+exclude = ['.jazz5', '.jazzShed']		# directory names, excluded at any depth
+
+class HashCache(object):
+	'''
+	SHA-1 digests of files, keyed by path and valid as long as the file's
+	size, mtime and ctime are unchanged; persisted to path (if any).
+
+	ctime is included because CCM sets work area mtimes to those of the
+	objects' versions (see migrate_task), so mtime alone may not change.
+	'''
+	def __init__(self, path=None):
+		self.path = path
+		self._lock = threading.Lock()
+		self._entries = dict()			# path -> (size, mtime, ctime, digest)
+		if path and os.path.isfile(path):
+			f = open(path, 'rb')
+			try:
+				self._entries = cPickle.load(f)
+			except (EOFError, cPickle.UnpicklingError), e:
+				log.warning('ignoring invalid hash cache "%s": %s' % (path, e))
+			finally:
+				f.close()
+	def digest(self, path, st):
+		key = (st.st_size, st.st_mtime, st.st_ctime)
+		with self._lock:
+			e = self._entries.get(path)
+		if e and e[:3] == key:
+			return e[3]
+		h = hashlib.sha1()
+		f = open(path, 'rb')
+		try:
+			for block in iter(lambda: f.read(1 << 20), ''):
+				h.update(block)
+		finally:
+			f.close()
+		with self._lock:
+			self._entries[path] = key + (h.hexdigest(),)
+		return h.hexdigest()
+	def save(self):
+		if not self.path:
+			return
+		tmp = '%s.tmp' % self.path
+		f = open(tmp, 'wb')
+		try:
+			with self._lock:
+				cPickle.dump(self._entries, f, cPickle.HIGHEST_PROTOCOL)
+		finally:
+			f.close()
+		os.rename(tmp, self.path)
+
+def walk(root, excluded=()):
+	'''
+	return {relative path: stat} of files (and symlinks) under root, except
+	in directories named in exclude or at paths (relative to root) in excluded
+	'''
+	excluded = set([os.path.normpath(p) for p in excluded])
+	files = dict()
+	for d, dirs, names in os.walk(root):
+		rel = os.path.relpath(d, root)
+		rel = '' if rel == '.' else rel
+		dirs[:] = [n for n in dirs if n not in exclude and os.path.join(rel, n) not in excluded]
+		for n in names:
+			p = os.path.join(d, n)
+			files[os.path.join(rel, n)] = os.lstat(p)
+	return files
+
+class Report(object):
+	'differences between trees a and b'
+	def __init__(self, only_a, only_b, differ):
+		self.only_a, self.only_b, self.differ = only_a, only_b, differ
+	def __nonzero__(self):
+		return bool(self.only_a or self.only_b or self.differ)
+	def __str__(self):
+		lines = (['only in work area: %s' % p for p in self.only_a] + ['only in sandbox: %s' % p for p in self.only_b]
+				 + ['contents differ: %s' % p for p in self.differ])
+		return '\n'.join(lines) if lines else 'trees are identical'
+
+def compare(a, b, excluded=(), cache=None, workers=8):
+	'''
+	compare files under a and b, ignoring directories named in exclude and
+	excluded paths (relative to the tree roots); return Report.
+
+	both trees are walked concurrently; files present in both with equal
+	sizes are hashed by a pool of workers, using cache where possible.
+	'''
+	cache = cache or HashCache()
+	pool = ThreadPool(workers)
+	try:
+		wa, wb = pool.apply_async(walk, (a, excluded)), pool.apply_async(walk, (b, excluded))
+		fa, fb = wa.get(), wb.get()
+		only_a = sorted(set(fa) - set(fb))
+		only_b = sorted(set(fb) - set(fa))
+		differ, candidates = list(), list()
+		for p in sorted(set(fa) & set(fb)):
+			if fa[p].st_size != fb[p].st_size:
+				differ.append(p)
+			else:
+				candidates.append(p)
+		def same(p):
+			if stat.S_ISLNK(fa[p].st_mode) or stat.S_ISLNK(fb[p].st_mode):
+				return (stat.S_ISLNK(fa[p].st_mode) and stat.S_ISLNK(fb[p].st_mode)
+						and os.readlink(os.path.join(a, p)) == os.readlink(os.path.join(b, p)))
+			return cache.digest(os.path.join(a, p), fa[p]) == cache.digest(os.path.join(b, p), fb[p])
+		differ += [p for p, eq in zip(candidates, pool.map(same, candidates)) if not eq]
+	finally:
+		pool.close()
+		pool.join()
+	cache.save()
+	return Report(only_a, only_b, sorted(differ))